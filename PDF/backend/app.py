@@ -9,12 +9,17 @@ import os
 import sys
 import base64
 import io
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from PIL import Image
 import numpy as np
 import traceback
 import logging
+import threading
+import time
+import json
+import random
+import tracemalloc
 
 # Add the mixtex path to the system path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'mixtexgui'))
@@ -22,13 +27,22 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'mixtexgui',
 
 # Import MixTeX core functionality
 try:
-    from mixtex_core import load_model, pad_image, stream_inference  # type: ignore
+    from mixtex_core import (  # type: ignore
+        LatexPostprocessor, load_model, pad_image, stream_inference, trim_whitespace, warmup
+    )
+    from mixtex_trace import NULL_TRACER, ProfilerSlot, Tracer  # type: ignore
+    from mixtex_memory import MemoryTracer, memory_report, native_heap, tracemalloc_top  # type: ignore
+    from mixtex_tune import session_settings, tune_once  # type: ignore
     print("✅ Successfully imported MixTeX core modules")
 except ImportError as e:
     print(f"❌ Failed to import MixTeX modules: {e}")
     print("Current path:", sys.path)
     sys.exit(1)
 
+from singleflight import FlightCancelled, SingleFlight, request_key
+from pdf_regions import PdfNotFound, PdfStore
+from model_registry import ModelRegistry, UnknownVersion
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,17 +50,98 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
-# Global model variable
-model = None
-model_loaded = False
+# The version loaded at startup (the registry itself is created below)
+initial_version = None
 model_error = None
 
+# Loading lifecycle of the initial version: ('tuning' ->) 'loading' -> 'warming'
+# -> 'ready', or 'error'. The server accepts connections throughout; only 'ready' serves OCR.
+model_state = 'loading'
+
+# Warm-up configuration (environment variables)
+WARMUP_ENABLED = os.environ.get('MIXTEX_WARMUP', '1') != '0'
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get('MIXTEX_WARMUP_BATCH_SIZES', '1').split(',') if b.strip()]
+WARMUP_DECODE_STEPS = int(os.environ.get('MIXTEX_WARMUP_DECODE_STEPS', '4'))
+
+# Decode budgets: requests may override both with 'deadline_ms' / 'max_tokens'.
+# 'auto' caps tokens from the ink in the image (see estimate_token_budget);
+# unset decodes up to the model's max_length.
+DEFAULT_DEADLINE_MS = float(os.environ['MIXTEX_DEADLINE_MS']) if os.environ.get('MIXTEX_DEADLINE_MS') else None
+DEFAULT_MAX_TOKENS = os.environ.get('MIXTEX_MAX_TOKENS') or None
+
+# Memory-map the weights written by mixtex_share_weights.py so that several
+# backend processes on one host share them (see /api/ocr/status 'memory')
+SHARED_WEIGHTS = os.environ.get('MIXTEX_SHARED_WEIGHTS', '0') == '1'
+
+# Thread settings come from mixtex_tune.py's stored results for this host and
+# this many backend processes sharing it; with MIXTEX_AUTOTUNE=1 a missing
+# entry is measured (and stored) before the first model load
+REPLICAS = int(os.environ.get('MIXTEX_REPLICAS', '1'))
+AUTOTUNE = os.environ.get('MIXTEX_AUTOTUNE', '0') == '1'
+
+# Uploaded PDFs, rendered server-side for page + bbox extraction requests
+pdf_store = PdfStore(
+    os.environ.get('MIXTEX_PDF_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_store')),
+    page_zoom=float(os.environ.get('MIXTEX_PDF_PAGE_ZOOM', '2.0')),
+    page_cache_size=int(os.environ.get('MIXTEX_PDF_PAGE_CACHE', '8')),
+    region_cache_size=int(os.environ.get('MIXTEX_PDF_REGION_CACHE', '64')),
+    max_bytes=int(float(os.environ.get('MIXTEX_PDF_STORE_MAX_MB', '2048')) * 1024 * 1024),
+    max_files=int(os.environ.get('MIXTEX_PDF_STORE_MAX_FILES', '500'))
+)
+PDF_MAX_BYTES = int(float(os.environ.get('MIXTEX_PDF_MAX_MB', '100')) * 1024 * 1024)
+
+# Whitespace kept around the ink bounding box when trimming selections
+TRIM_MARGIN = int(os.environ.get('MIXTEX_TRIM_MARGIN', '8'))
+
+# Identical requests (same pixels and options) arriving while one is being
+# processed share its result instead of running the model again; at most
+# MIXTEX_MAX_CONCURRENT distinct extractions run at once, the rest queue
+inflight = SingleFlight(int(os.environ.get('MIXTEX_MAX_CONCURRENT', '4')))
+
+# Profiling: a request with "profile": true, or a sampled fraction of all
+# requests, is traced with ORT profiling on and saved as Chrome trace JSON.
+# Each model version keeps one warmed pair of profiled sessions (built on its
+# first profiled request); sampled requests that find it busy run unprofiled.
+PROFILE_DIR = os.environ.get('MIXTEX_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('MIXTEX_PROFILE_SAMPLE_RATE', '0'))
+profilers = {}
+profilers_lock = threading.Lock()
+
+# Memory instrumentation (see /api/ocr/memory): per-stage RSS of every request
+# while stage tracing is on, and tracemalloc with this many frames if > 0
+memory_tracer = MemoryTracer()
+memory_tracing = os.environ.get('MIXTEX_MEMORY_TRACE', '0') == '1'
+TRACEMALLOC_FRAMES = int(os.environ.get('MIXTEX_TRACEMALLOC', '0'))
+if TRACEMALLOC_FRAMES > 0:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+# Model administration (/api/ocr/models POST routes) is allowed with this
+# token in the X-Admin-Token header; without it, only from localhost
+ADMIN_TOKEN = os.environ.get('MIXTEX_ADMIN_TOKEN')
+MODEL_OPTIONS = ('encoder_threads', 'decoder_threads', 'shared_weights', 'greedy_head', 'replicas')
+
+def warm_model(loaded_model):
+    """Warm up a freshly loaded model (if enabled)"""
+    if not WARMUP_ENABLED:
+        return
+    try:
+        warmup(loaded_model, batch_sizes=WARMUP_BATCH_SIZES, decode_steps=WARMUP_DECODE_STEPS)
+    except Exception as e:
+        # A failed warm-up only costs latency on the first requests
+        logger.warning(f"Model warm-up failed: {e}")
+
+# Loaded model versions (see model_registry.py). The first one is loaded at
+# startup; more can be loaded, canaried and promoted through /api/ocr/models
+# while the server keeps serving.
+registry = ModelRegistry(load_model, warm_model)
+
 def initialize_model():
-    """Initialize the MixTeX model on server startup"""
-    global model, model_loaded, model_error
+    """Initialize and warm up the MixTeX model"""
+    global initial_version, model_error, model_state
     
     try:
         print("🔄 Initializing MixTeX model...")
+        model_state = 'loading'
         
         # Try to find the onnx model directory
         possible_paths = [
@@ -67,22 +162,70 @@ def initialize_model():
         
         print(f"📁 Using model path: {onnx_path}")
         
-        # Load the model
-        model = load_model(onnx_path)
-        model_loaded = True
+        if AUTOTUNE:
+            autotune(onnx_path)
+        
+        # Load and warm the model; /api/ocr/health follows its state meanwhile
+        initial_version = registry.load(onnx_path, {'shared_weights': SHARED_WEIGHTS, 'replicas': REPLICAS})
+        state = registry.wait_loaded(initial_version)
+        if state != 'ready':
+            raise RuntimeError(initial_version.error or f'model version {initial_version.name} was {state}')
+        print(f"✅ MixTeX model loaded in {initial_version.load_seconds}s")
+        if WARMUP_ENABLED:
+            print(f"🔥 Warm-up finished in {initial_version.warmup_seconds}s (batch sizes {WARMUP_BATCH_SIZES})")
+        
+        registry.promote(initial_version.name)
         model_error = None
+        model_state = 'ready'
         
-        print("✅ MixTeX model loaded successfully!")
+        print("✅ MixTeX model is ready!")
         return True
         
     except Exception as e:
         error_msg = f"Failed to load MixTeX model: {str(e)}"
         print(f"❌ {error_msg}")
         print(f"📄 Traceback: {traceback.format_exc()}")
-        model_loaded = False
         model_error = error_msg
+        model_state = 'error'
         return False
 
+def autotune(onnx_path):
+    """
+    Benchmark thread settings for this host unless they are already stored
+    (or another replica is storing them). Tuning is an optimization: if it
+    fails the model still loads, with default thread settings.
+    """
+    global model_state
+    model_state = 'tuning'
+    try:
+        entry, tuned = tune_once(onnx_path, replicas=REPLICAS, shared_weights=SHARED_WEIGHTS,
+                                 max_batch=max(WARMUP_BATCH_SIZES), report=logger.info)
+        if tuned:
+            print(f"⏱️  Tuned: encoder {entry['encoder']}, decoder {entry['decoder']}")
+    except Exception as e:
+        logger.warning(f"Thread tuning failed, loading with default thread settings: {e}")
+    finally:
+        model_state = 'loading'
+
+def start_model_loading():
+    """Load the model in the background so the server can start accepting connections"""
+    thread = threading.Thread(target=initialize_model, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+def serving_state():
+    """'ready' once a model version is serving, else the initial load's state"""
+    if registry.current is not None:
+        return 'ready'
+    if model_state == 'loading' and initial_version is not None:
+        return initial_version.state
+    return model_state
+
+def model_not_ready_message():
+    if model_state == 'error':
+        return f'Model not loaded: {model_error}'
+    return f'Model is not ready yet (state: {serving_state()})'
+
 def preprocess_image(image, preprocessing_level='moderate'):
     """
     Preprocess the image based on the specified level
@@ -114,198 +257,637 @@ def preprocess_image(image, preprocessing_level='moderate'):
         logger.error(f"Error in image preprocessing: {e}")
         return image
 
-def extract_latex_from_image(image, preprocessing_level='moderate'):
+def extract_latex_from_image(image, run_model, preprocessing_level='moderate', deadline_ms=None, max_tokens=None,
+                             on_token=None, tracer=NULL_TRACER, inline_dollars=False, align_to_equations=False):
     """
     Extract LaTeX content from image using MixTeX model
+    Returns (latex, info) where info holds the token count, stop_reason and
+    whether the output was truncated by max_tokens or the deadline.
+    run_model is the loaded model to run (a registry version's, or profiled
+    sessions). The output is post-processed as it is decoded (see
+    LatexPostprocessor); on_token, if given, is called with each piece of
+    that final output, so the pieces join to the returned latex. tracer
+    records spans for each stage.
     """
-    global model, model_loaded
-    
-    if not model_loaded or model is None:
+    if run_model is None:
         raise Exception("MixTeX model is not loaded")
     
     try:
         # Preprocess the image
-        processed_image = preprocess_image(image, preprocessing_level)
+        with tracer.span('preprocess_image', level=preprocessing_level):
+            processed_image = preprocess_image(image, preprocessing_level)
+        
+        # Skip the model for blank selections, trim the rest to their ink
+        with tracer.span('trim_whitespace'):
+            processed_image = trim_whitespace(processed_image, margin=TRIM_MARGIN)
+        if processed_image is None:
+            return '', {'tokens': 0, 'stop_reason': 'blank', 'truncated': False}
         
         # Pad image to required dimensions (448x448 for MixTeX)
-        padded_image = pad_image(processed_image, (448, 448))
+        with tracer.span('pad_image'):
+            padded_image = pad_image(processed_image, (448, 448))
         
-        # Extract LaTeX using MixTeX streaming inference
+        # Extract LaTeX using MixTeX streaming inference, cleaning up the
+        # output (strip, \[ -> \begin{align*}, % -> \%, ...) as it arrives
+        postprocessor = LatexPostprocessor(inline_dollars, align_to_equations)
         latex_parts = []
-        for piece in stream_inference(padded_image, model):
-            latex_parts.append(piece)
-        
-        # Join all parts to get complete LaTeX
-        full_latex = ''.join(latex_parts)
+        info = {}
         
-        # Clean up the output
-        full_latex = full_latex.strip()
+        def emit(piece):
+            if piece:
+                latex_parts.append(piece)
+                if on_token is not None:
+                    on_token(piece)
         
-        # Replace common formatting
-        full_latex = full_latex.replace('\\[', '\\begin{align*}').replace('\\]', '\\end{align*}')
-        full_latex = full_latex.replace('%', '\\%')
+        for token in stream_inference(padded_image, run_model, deadline_ms=deadline_ms,
+                                      max_tokens=max_tokens, info=info, tracer=tracer):
+            emit(postprocessor.feed(token))
+        emit(postprocessor.finish())
         
-        return full_latex
+        return ''.join(latex_parts), info
         
+    except FlightCancelled:
+        logger.info("LaTeX extraction cancelled: every client disconnected")
+        raise
     except Exception as e:
         logger.error(f"Error in LaTeX extraction: {e}")
         raise
 
 @app.route('/api/ocr/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'ready' if model_loaded else 'error',
-        'message': 'MixTeX OCR backend is running' if model_loaded else model_error,
-        'model_loaded': model_loaded
-    })
+    """
+    Health check endpoint
+    Readiness by default: 200 once the model is loaded and warm, 503 before.
+    With ?probe=live it only reports that the process is serving (always 200).
+    """
+    ready = registry.current is not None
+    payload = {
+        'status': serving_state(),
+        'live': True,
+        'ready': ready,
+        'message': 'MixTeX OCR backend is running' if ready else model_not_ready_message(),
+        'model_loaded': ready,
+        'model_version': registry.current.name if ready else None,
+        'load_seconds': initial_version.load_seconds if initial_version else None,
+        'warmup_seconds': initial_version.warmup_seconds if initial_version else None
+    }
+    if request.args.get('probe') == 'live':
+        return jsonify(payload)
+    return jsonify(payload), (200 if ready else 503)
 
 @app.route('/api/ocr/status', methods=['GET'])
 def status_check():
     """Status check endpoint"""
+    try:
+        memory = memory_report()
+    except OSError:
+        memory = None  # /proc is Linux-only
+    ready = registry.current is not None
     return jsonify({
-        'status': 'ready' if model_loaded else 'error',
-        'message': 'MixTeX model is ready' if model_loaded else model_error,
-        'model_loaded': model_loaded,
+        'status': serving_state(),
+        'message': 'MixTeX model is ready' if ready else model_not_ready_message(),
+        'model_loaded': ready,
+        'model_version': registry.current.name if ready else None,
+        'load_seconds': initial_version.load_seconds if initial_version else None,
+        'warmup_seconds': initial_version.warmup_seconds if initial_version else None,
+        'models': registry.stats(),
+        'sessions': {
+            'encoder': session_settings(registry.current.model[2]),
+            'decoder': session_settings(registry.current.model[3])
+        } if ready else None,
+        'inflight': inflight.stats(),
+        'shared_weights': SHARED_WEIGHTS,
+        'memory': memory,
+        'pdf': pdf_store.stats(),
         'backend': 'MixTeX'
     })
 
+def error_response(message, status, **extra):
+    return jsonify({
+        'success': False,
+        'message': message,
+        'formulas': [],
+        'text_content': [],
+        'raw_result': '',
+        **extra
+    }), status
+
+def decode_image_data(image_data):
+    """Decode a base64 image (optionally a data URL); returns (image, None) or (None, error_response)"""
+    try:
+        if image_data.startswith('data:image/'):
+            # Remove data URL prefix
+            image_data = image_data.split(',')[1]
+
+        # Decode base64
+        image_bytes = base64.b64decode(image_data)
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+
+        logger.info(f"Image decoded successfully: {image.size} {image.mode}")
+        return image, None
+
+    except Exception as e:
+        return None, error_response(f'Failed to decode image: {str(e)}', 400)
+
+def render_pdf_region(region):
+    """
+    Render {"doc_id", "page", "bbox"} from an uploaded PDF
+    Returns (image, None) or (None, error_response)
+    """
+    if not pdf_store.available:
+        return None, error_response('PDF regions need PyMuPDF on the server (pip install pymupdf)', 501)
+    try:
+        image = pdf_store.render_region(region['doc_id'], int(region['page']), region['bbox'])
+    except PdfNotFound:
+        return None, error_response('Unknown doc_id: upload the PDF to /api/ocr/pdf first', 404)
+    except (KeyError, TypeError, ValueError) as e:
+        return None, error_response(f'Invalid pdf region: {str(e)}', 400)
+
+    logger.info(f"Rendered PDF region: page {region['page']} {image.size}")
+    return image, None
+
+def parse_extract_request():
+    """
+    Validate an extraction request and decode its image
+    Returns (params, None) on success or (None, error_response) otherwise
+    """
+    received = time.perf_counter()
+    
+    # Check if model is loaded
+    if registry.current is None:
+        return None, error_response(model_not_ready_message(), 500 if model_state == 'error' else 503)
+    
+    # Get request data
+    data = request.get_json()
+    if not data:
+        return None, error_response('No JSON data provided', 400)
+    
+    # Extract image data: an uploaded image, or a region of a PDF uploaded to /api/ocr/pdf
+    image_data = data.get('image_data')
+    pdf_region = data.get('pdf')
+    if not image_data and not pdf_region:
+        return None, error_response('No image_data (or pdf region) provided', 400)
+    
+    preprocessing_level = data.get('preprocessing_level', 'moderate')
+    deadline_ms = data.get('deadline_ms', DEFAULT_DEADLINE_MS)
+    max_tokens = data.get('max_tokens', DEFAULT_MAX_TOKENS)
+    try:
+        deadline_ms = None if deadline_ms is None else float(deadline_ms)
+        if max_tokens is not None and max_tokens != 'auto':
+            max_tokens = int(max_tokens)
+    except (TypeError, ValueError):
+        return None, error_response('deadline_ms must be a number and max_tokens an integer or "auto"', 400)
+    inline_dollars = data.get('inline_dollars', False)
+    align_to_equations = data.get('align_to_equations', False)
+    if not isinstance(inline_dollars, bool) or not isinstance(align_to_equations, bool):
+        return None, error_response('inline_dollars and align_to_equations must be booleans', 400)
+    
+    logger.info(f"Processing OCR request with preprocessing level: {preprocessing_level}")
+    
+    decode_started = time.perf_counter()
+    if pdf_region:
+        image, error = render_pdf_region(pdf_region)
+    else:
+        image, error = decode_image_data(image_data)
+    if error:
+        return None, error
+
+    return {
+        'image': image,
+        'preprocessing_level': preprocessing_level,
+        'deadline_ms': deadline_ms,
+        'max_tokens': max_tokens,
+        'inline_dollars': inline_dollars,
+        'align_to_equations': align_to_equations,
+        'profile': 'requested' if data.get('profile') else 'sampled' if random.random() < PROFILE_SAMPLE_RATE else None,
+        'received': received,
+        'decode_span': (decode_started, time.perf_counter())
+    }, None
+
+def start_extraction(params):
+    """Start (or join an identical in-flight) extraction; returns its Flight"""
+    # Pick the version (current or canary) up front: requests only coalesce
+    # with identical requests running on the same version
+    version = registry.route()
+    options = {
+        'preprocessing_level': params['preprocessing_level'],
+        'deadline_ms': params['deadline_ms'],
+        'max_tokens': params['max_tokens'],
+        'inline_dollars': params['inline_dollars'],
+        'align_to_equations': params['align_to_equations'],
+        'profile': params['profile'],
+        'model_version': version.name
+    }
+    key = request_key(params['image'], options)
+    
+    def compute(publish):
+        deadline_ms = params['deadline_ms']
+        if deadline_ms is not None:
+            # The budget covers the whole request, including upload decoding
+            deadline_ms = max(0.0, deadline_ms - (time.perf_counter() - params['received']) * 1000)
+        with registry.lease(version) as leased:
+            profiled = None
+            if params['profile']:
+                profiler = profiler_for(leased)
+                profiled = profiler.acquire(wait=params['profile'] == 'requested')
+            if profiled is None:
+                latex_result, info = extract_latex_from_image(params['image'], leased.model,
+                                                              params['preprocessing_level'], deadline_ms,
+                                                              params['max_tokens'], on_token=publish,
+                                                              tracer=memory_tracer if memory_tracing else NULL_TRACER,
+                                                              inline_dollars=params['inline_dollars'],
+                                                              align_to_equations=params['align_to_equations'])
+            else:
+                latex_result, info = profiled_extraction(params, profiler, profiled, deadline_ms, publish, key)
+        info['model_version'] = leased.name
+        return latex_result, info
+    
+    return inflight.join(key, compute)
+
+def profiler_for(version):
+    """The ProfilerSlot of a model version; frees those of retired versions"""
+    with profilers_lock:
+        for name, (owner, slot) in list(profilers.items()):
+            if owner.state in ('draining', 'retired'):
+                del profilers[name]
+                slot.close()
+        if version.name not in profilers:
+            profilers[version.name] = (version, ProfilerSlot(version.model, version.model_dir, PROFILE_DIR,
+                                                             shared_weights=version.options.get('shared_weights', False),
+                                                             warm=warm_model))
+        return profilers[version.name][1]
+
+def profiled_extraction(params, profiler, profiled, deadline_ms, publish, key):
+    """Run one extraction on profiled sessions with span tracing; saves the trace to PROFILE_DIR"""
+    # The timeline starts when the request arrived, before its image was decoded
+    tracer = Tracer(t0=params['received'])
+    tracer.record('image_decode', *params['decode_span'])
+    try:
+        latex_result, info = extract_latex_from_image(params['image'], profiled.model, params['preprocessing_level'],
+                                                      deadline_ms, params['max_tokens'], on_token=publish,
+                                                      tracer=tracer, inline_dollars=params['inline_dollars'],
+                                                      align_to_equations=params['align_to_equations'])
+    finally:
+        profiler.finish(profiled, tracer)
+        path = os.path.join(PROFILE_DIR, f"trace_{time.strftime('%Y%m%d-%H%M%S')}_{key[:8]}.json")
+        tracer.save(path)
+        logger.info(f"Saved request profile to {path}")
+    info['profile'] = path
+    return latex_result, info
+
+def extraction_result(latex_result, info, preprocessing_level):
+    """Build the JSON body for a finished extraction"""
+    budget = {
+        'truncated': info.get('truncated', False),
+        'stop_reason': info.get('stop_reason'),
+        'tokens': info.get('tokens', 0),
+        'model_version': info.get('model_version')
+    }
+    if info.get('profile'):
+        budget['profile'] = info['profile']
+    
+    # Format the response - MixTeX typically returns mathematical formulas
+    if not latex_result:
+        return {
+            'success': False,
+            'message': 'No content detected in the image',
+            'formulas': [],
+            'text_content': [],
+            'raw_result': '',
+            'preprocessing_level': preprocessing_level,
+            **budget
+        }
+    
+    # Check if it contains mathematical content
+    is_formula = any(char in latex_result for char in ['\\', '{', '}', '^', '_', '$'])
+    
+    if is_formula:
+        formulas = [latex_result]
+        text_content = []
+    else:
+        formulas = []
+        text_content = [latex_result]
+    
+    return {
+        'success': True,
+        'message': 'Content extracted successfully',
+        'formulas': formulas,
+        'text_content': text_content,
+        'raw_result': latex_result,
+        'preprocessing_level': preprocessing_level,
+        **budget
+    }
+
 @app.route('/api/ocr/extract', methods=['POST'])
 def extract_content():
     """
     Extract mathematical content from image data
     Expected JSON payload:
     {
-        "image_data": "data:image/png;base64,iVBOR...",
-        "preprocessing_level": "moderate"  // optional: minimal, moderate, aggressive
+        "image_data": "data:image/png;base64,iVBOR...",  // or, for a PDF uploaded to /api/ocr/pdf:
+        // "pdf": {"doc_id": "<sha256>", "page": 1, "bbox": [x0, y0, x1, y1]}  (fractions of the page)
+        "preprocessing_level": "moderate",  // optional: minimal, moderate, aggressive
+        "deadline_ms": 2000,                // optional: wall-clock budget for this request
+        "max_tokens": 256,                  // optional: token budget, or "auto"
+        "inline_dollars": false,            // optional: \\( \\) -> $
+        "align_to_equations": false,        // optional: one $$ ... $$ line per align* row
+        "profile": true                     // optional: save a Chrome trace of this request
     }
+    Output cut short by a budget is returned with "truncated": true.
+    Profiled requests return the saved trace path as "profile".
     """
     try:
-        # Check if model is loaded
-        if not model_loaded:
-            return jsonify({
-                'success': False,
-                'message': f'Model not loaded: {model_error}',
-                'formulas': [],
-                'text_content': [],
-                'raw_result': ''
-            }), 500
-        
-        # Get request data
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'message': 'No JSON data provided',
-                'formulas': [],
-                'text_content': [],
-                'raw_result': ''
-            }), 400
-        
-        # Extract image data
-        image_data = data.get('image_data')
-        if not image_data:
-            return jsonify({
-                'success': False,
-                'message': 'No image_data provided',
-                'formulas': [],
-                'text_content': [],
-                'raw_result': ''
-            }), 400
-        
-        preprocessing_level = data.get('preprocessing_level', 'moderate')
-        
-        logger.info(f"Processing OCR request with preprocessing level: {preprocessing_level}")
-        
-        # Decode base64 image
-        try:
-            if image_data.startswith('data:image/'):
-                # Remove data URL prefix
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            logger.info(f"Image decoded successfully: {image.size} {image.mode}")
-            
-        except Exception as e:
-            return jsonify({
-                'success': False,
-                'message': f'Failed to decode image: {str(e)}',
-                'formulas': [],
-                'text_content': [],
-                'raw_result': ''
-            }), 400
+        params, error = parse_extract_request()
+        if error:
+            return error
+        preprocessing_level = params['preprocessing_level']
         
         # Extract LaTeX using MixTeX
         try:
-            latex_result = extract_latex_from_image(image, preprocessing_level)
+            flight = start_extraction(params)
+            try:
+                latex_result, info = flight.wait()
+            finally:
+                flight.leave()
             
             logger.info(f"LaTeX extraction successful: {len(latex_result)} characters")
             
-            # Format the response - MixTeX typically returns mathematical formulas
-            if latex_result:
-                # Check if it contains mathematical content
-                is_formula = any(char in latex_result for char in ['\\', '{', '}', '^', '_', '$'])
-                
-                if is_formula:
-                    formulas = [latex_result]
-                    text_content = []
-                else:
-                    formulas = []
-                    text_content = [latex_result]
-                
-                return jsonify({
-                    'success': True,
-                    'message': 'Content extracted successfully',
-                    'formulas': formulas,
-                    'text_content': text_content,
-                    'raw_result': latex_result,
-                    'preprocessing_level': preprocessing_level
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'message': 'No content detected in the image',
-                    'formulas': [],
-                    'text_content': [],
-                    'raw_result': '',
-                    'preprocessing_level': preprocessing_level
-                })
+            return jsonify(extraction_result(latex_result, info, preprocessing_level))
                 
         except Exception as e:
             logger.error(f"LaTeX extraction failed: {str(e)}")
-            return jsonify({
-                'success': False,
-                'message': f'OCR processing failed: {str(e)}',
-                'formulas': [],
-                'text_content': [],
-                'raw_result': '',
-                'preprocessing_level': preprocessing_level
-            }), 500
+            return error_response(f'OCR processing failed: {str(e)}', 500, preprocessing_level=preprocessing_level)
             
     except Exception as e:
         logger.error(f"Unexpected error in extract_content: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
-        return jsonify({
-            'success': False,
-            'message': f'Unexpected error: {str(e)}',
-            'formulas': [],
-            'text_content': [],
-            'raw_result': ''
-        }), 500
+        return error_response(f'Unexpected error: {str(e)}', 500)
+
+@app.route('/api/ocr/extract/stream', methods=['POST'])
+def extract_content_stream():
+    """
+    Streaming variant of /api/ocr/extract (same payload)
+    Responds with newline-delimited JSON: {"token": "..."} per piece of
+    post-processed output as it is decoded (the pieces join to raw_result),
+    then one final object with the same fields as /api/ocr/extract.
+    """
+    params, error = parse_extract_request()
+    if error:
+        return error
+    flight = start_extraction(params)
+    
+    def generate():
+        # A client that disconnects closes this generator; leaving the flight
+        # cancels the decode if nobody else is waiting for it
+        try:
+            for token in flight.stream():
+                yield json.dumps({'token': token}) + '\n'
+            try:
+                latex_result, info = flight.wait()
+                final = extraction_result(latex_result, info, params['preprocessing_level'])
+            except Exception as e:
+                logger.error(f"LaTeX extraction failed: {str(e)}")
+                final = {'success': False, 'message': f'OCR processing failed: {str(e)}', 'formulas': [],
+                         'text_content': [], 'raw_result': ''}
+            yield json.dumps({'done': True, **final}) + '\n'
+        finally:
+            flight.leave()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/ocr/pdf', methods=['POST'])
+def upload_pdf():
+    """
+    Store a PDF for region extraction
+    The body is the PDF itself (application/pdf) or a multipart 'file' field.
+    Returns {"doc_id": <sha256>, "pages": n}; uploading the same file again is a no-op.
+    """
+    if not pdf_store.available:
+        return jsonify({'success': False, 'message': 'PDF upload needs PyMuPDF on the server (pip install pymupdf)'}), 501
+    too_large = {'success': False, 'message': f'PDF larger than {PDF_MAX_BYTES // (1024 * 1024)} MB'}
+    # Refuse oversized bodies before reading them (64 KB of room for multipart framing)
+    if request.content_length is not None and request.content_length > PDF_MAX_BYTES + 64 * 1024:
+        return jsonify(too_large), 413
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        pdf_bytes = upload.read(PDF_MAX_BYTES + 1) if upload else b''
+    else:
+        pdf_bytes = request.stream.read(PDF_MAX_BYTES + 1)
+    if not pdf_bytes:
+        return jsonify({'success': False, 'message': 'No PDF provided'}), 400
+    if len(pdf_bytes) > PDF_MAX_BYTES:
+        return jsonify(too_large), 413
+    try:
+        doc_id, pages = pdf_store.add(pdf_bytes)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Failed to open PDF: {str(e)}'}), 400
+    logger.info(f"Stored PDF {doc_id[:12]} ({pages} pages, {len(pdf_bytes)} bytes)")
+    return jsonify({'success': True, 'doc_id': doc_id, 'pages': pages})
+
+@app.route('/api/ocr/pdf/<doc_id>', methods=['GET'])
+def pdf_info(doc_id):
+    """Whether a PDF (by SHA-256) is already stored, so clients can skip the upload"""
+    if not pdf_store.available or not pdf_store.has(doc_id):
+        return jsonify({'success': False, 'message': 'Unknown doc_id'}), 404
+    return jsonify({'success': True, 'doc_id': doc_id, 'pages': pdf_store.page_count(doc_id)})
+
+def parse_percent(value):
+    """value as a float in 0..100, or None if it is not one"""
+    try:
+        percent = float(value)
+    except (TypeError, ValueError):
+        return None
+    return percent if 0 <= percent <= 100 else None
+
+def admin_denied():
+    """None if the request may administer models, else an error response"""
+    if ADMIN_TOKEN:
+        if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+            return jsonify({'success': False, 'message': 'Invalid or missing X-Admin-Token'}), 403
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'success': False, 'message': 'Set MIXTEX_ADMIN_TOKEN to manage models remotely'}), 403
+    return None
+
+@app.route('/api/ocr/models', methods=['GET'])
+def list_models():
+    """Loaded model versions, which one is current, the canary and per-version latency"""
+    return jsonify(registry.stats())
+
+@app.route('/api/ocr/models', methods=['POST'])
+def load_model_version():
+    """
+    Load a model version in the background
+    Expected JSON payload:
+    {
+        "model_dir": "/models/mixtex-int8",   // directory with the ONNX files and tokenizer
+        "name": "int8",                       // optional: version name (default v<n>)
+        "options": {"decoder_threads": 4},    // optional: encoder_threads, decoder_threads,
+                                              //   shared_weights, greedy_head
+        "activate": "promote",                // optional: "promote" or "canary" once warm
+        "canary_percent": 10                  // with "activate": "canary"
+    }
+    Returns 202 at once; follow the version's state in GET /api/ocr/models.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json() or {}
+    model_path = data.get('model_dir')
+    options = data.get('options') or {}
+    activate = data.get('activate')
+    if not model_path or not os.path.isdir(model_path):
+        return jsonify({'success': False, 'message': 'model_dir must be an existing directory'}), 400
+    unknown = set(options) - set(MODEL_OPTIONS)
+    if unknown:
+        return jsonify({'success': False, 'message': f'Unknown options {sorted(unknown)}; allowed: {MODEL_OPTIONS}'}), 400
+    if activate not in (None, 'promote', 'canary'):
+        return jsonify({'success': False, 'message': 'activate must be "promote" or "canary"'}), 400
+    canary_percent = parse_percent(data.get('canary_percent', 10))
+    if canary_percent is None:
+        return jsonify({'success': False, 'message': 'canary_percent must be a number from 0 to 100'}), 400
+
+    def on_ready(version):
+        try:
+            if activate == 'promote':
+                registry.promote(version.name)
+            elif activate == 'canary':
+                registry.set_canary(version.name, canary_percent)
+        except ValueError as e:
+            logger.warning(f"Could not activate model version {version.name}: {e}")
+            return
+        logger.info(f"Model version {version.name} ready ({activate or 'loaded'})")
+
+    try:
+        version = registry.load(os.path.abspath(model_path), options, name=data.get('name'), on_ready=on_ready)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    logger.info(f"Loading model version {version.name} from {version.model_dir}")
+    return jsonify({'success': True, 'version': version.name, 'state': version.state}), 202
+
+@app.route('/api/ocr/models/<name>/promote', methods=['POST'])
+def promote_model_version(name):
+    """Switch all new requests to a ready version; the previous one drains and is freed"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        registry.promote(name)
+    except UnknownVersion:
+        return jsonify({'success': False, 'message': f'Unknown model version {name!r}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    logger.info(f"Promoted model version {name}")
+    return jsonify({'success': True, **registry.stats()})
+
+@app.route('/api/ocr/models/canary', methods=['POST'])
+def set_canary_version():
+    """Route {"percent": 0-100} of new requests to {"version": name}; percent 0 stops the canary"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json() or {}
+    percent = parse_percent(data.get('percent', 0))
+    if percent is None:
+        return jsonify({'success': False, 'message': 'percent must be a number from 0 to 100'}), 400
+    try:
+        registry.set_canary(data.get('version'), percent)
+    except UnknownVersion:
+        return jsonify({'success': False, 'message': f"Unknown model version {data.get('version')!r}"}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, **registry.stats()})
+
+@app.route('/api/ocr/models/<name>', methods=['DELETE'])
+def retire_model_version(name):
+    """Stop routing to a (non-current) version and free it once its requests finish"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        registry.retire(name)
+    except UnknownVersion:
+        return jsonify({'success': False, 'message': f'Unknown model version {name!r}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, **registry.stats()})
+
+@app.route('/api/ocr/memory', methods=['GET'])
+def memory_status():
+    """
+    Where the process's memory is: RSS/PSS and mapped weights, the C heap
+    (ONNX Runtime arenas, numpy), per-stage RSS of traced requests and, if
+    tracemalloc is on, the top Python allocators (?top=N, default 10).
+    Admin only, like the POST: the allocator list names source files and lines.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'top must be an integer'}), 400
+    if top < 1:
+        return jsonify({'success': False, 'message': 'top must be at least 1'}), 400
+    try:
+        process = memory_report()
+    except OSError:
+        process = None  # /proc is Linux-only
+    return jsonify({
+        'process': process,
+        'native_heap': native_heap(),
+        'stage_tracing': memory_tracing,
+        'stages': memory_tracer.report(),
+        'tracemalloc': tracemalloc_top(top)
+    })
+
+@app.route('/api/ocr/memory', methods=['POST'])
+def configure_memory_tracing():
+    """
+    Turn instrumentation on or off:
+    {"stage_tracing": true, "tracemalloc": 5, "reset": true}
+    tracemalloc is false or a number of frames to record per allocation;
+    reset clears the per-stage statistics.
+    """
+    global memory_tracing
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json() or {}
+    frames = data.get('tracemalloc')
+    if frames:
+        try:
+            frames = int(frames)
+        except (TypeError, ValueError):
+            frames = 0
+        if frames < 1:
+            return jsonify({'success': False, 'message': 'tracemalloc must be false or a number of frames (>= 1)'}), 400
+    if 'stage_tracing' in data:
+        memory_tracing = bool(data['stage_tracing'])
+    if 'tracemalloc' in data:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if frames:
+            tracemalloc.start(frames)
+    if data.get('reset'):
+        memory_tracer.reset()
+    return jsonify({'success': True, 'stage_tracing': memory_tracing, 'tracemalloc': tracemalloc.is_tracing()})
 
 @app.route('/api/ocr/test', methods=['GET'])
 def test_endpoint():
     """Test endpoint to verify the API is working"""
     return jsonify({
         'message': 'MixTeX OCR backend is working!',
-        'model_loaded': model_loaded,
+        'model_loaded': registry.current is not None,
         'endpoints': {
             'health': '/api/ocr/health',
             'status': '/api/ocr/status', 
             'extract': '/api/ocr/extract (POST)',
+            'extract_stream': '/api/ocr/extract/stream (POST)',
+            'pdf_upload': '/api/ocr/pdf (POST)',
+            'pdf_info': '/api/ocr/pdf/<doc_id>',
+            'models': '/api/ocr/models (GET, POST)',
+            'memory': '/api/ocr/memory (GET, POST)',
             'test': '/api/ocr/test'
         }
     })
@@ -313,18 +895,19 @@ def test_endpoint():
 if __name__ == '__main__':
     print("🚀 Starting MixTeX OCR Backend Server...")
     
-    # Initialize the model
-    if initialize_model():
-        print("✅ Model initialization successful!")
-    else:
-        print("❌ Model initialization failed - server will run but OCR will not work")
+    # Load the model in the background; /api/ocr/health reports readiness
+    start_model_loading()
     
     # Start the Flask server
     print("🌐 Starting Flask server on http://localhost:5001")
     print("📋 Available endpoints:")
-    print("   GET  /api/ocr/health   - Health check")
+    print("   GET  /api/ocr/health   - Readiness (?probe=live for liveness)")
     print("   GET  /api/ocr/status   - Status check")
     print("   POST /api/ocr/extract  - Extract LaTeX from image")
+    print("   POST /api/ocr/extract/stream - Same, streamed as NDJSON tokens")
+    print("   POST /api/ocr/pdf      - Upload a PDF for page + bbox extraction")
+    print("   GET  /api/ocr/models   - Model versions; POST to load, canary or promote one")
+    print("   GET  /api/ocr/memory   - Memory per stage, C heap, tracemalloc; POST to toggle tracing")
     print("   GET  /api/ocr/test     - Test endpoint")
     
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
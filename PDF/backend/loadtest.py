@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Load generator for the MixTeX OCR backend
+Replays a corpus of images against /api/ocr/extract (or the streaming route)
+and reports throughput, latency percentiles, error and 429 rates and, for
+/api/ocr/extract/stream, time to first token.
+
+Closed loop (N clients, each sending its next request when the last returns):
+    python loadtest.py --images ./crops --concurrency 1,2,4,8,16 --duration 30
+Open loop (Poisson arrivals at a fixed rate, latency measured from the
+scheduled arrival so server queueing is not hidden):
+    python loadtest.py --images ./crops --rate 1,2,4 --duration 30
+Exercising the harness itself against a built-in stub server:
+    python loadtest.py --stub --concurrency 1,2,4,8 --duration 5
+
+Only the standard library is used. Identical images sent concurrently are
+coalesced by the backend (see singleflight.py); the coalesced count from
+/api/ocr/status is reported per level, so use a corpus at least as large as
+the concurrency when sizing a fleet.
+"""
+
+import argparse
+import base64
+import glob
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+# 1x1 white PNG, the corpus for --stub runs without --images
+BLANK_PNG = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4'
+             'AAAAAElFTkSuQmCC')
+
+def load_corpus(paths):
+    """Base64 data URLs for every image file under paths (files, directories or .mxshard shards)"""
+    corpus = []
+    for path in paths:
+        if path.endswith('.mxshard'):
+            sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'mixtexgui', 'examples'))
+            from mixtex_shard import ShardReader
+            with ShardReader(path) as reader:
+                corpus += [to_data_url(record.image) for record in reader if record.image]
+            continue
+        files = [path] if os.path.isfile(path) else sorted(
+            f for f in glob.glob(os.path.join(path, '**', '*'), recursive=True)
+            if f.lower().endswith(IMAGE_EXTENSIONS))
+        for file in files:
+            with open(file, 'rb') as f:
+                corpus.append(to_data_url(f.read()))
+    return corpus
+
+def to_data_url(image_bytes):
+    return 'data:image/png;base64,' + base64.b64encode(image_bytes).decode('ascii')
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list (None if empty)"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class Sample:
+    __slots__ = ('latency', 'ttft', 'status', 'error')
+
+    def __init__(self, latency, ttft, status, error):
+        self.latency = latency
+        self.ttft = ttft
+        self.status = status
+        self.error = error
+
+def send_request(url, body, stream, timeout, started=None):
+    """
+    POST one extraction request and time it
+    started defaults to now; open-loop runs pass the scheduled arrival time.
+    """
+    if started is None:
+        started = time.perf_counter()
+    ttft = None
+    status = None
+    error = None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            status = resp.status
+            if stream:
+                last = {}
+                for line in resp:
+                    if not line.strip():
+                        continue
+                    last = json.loads(line)
+                    if ttft is None and 'token' in last:
+                        ttft = time.perf_counter() - started
+                if not last.get('done'):
+                    error = 'stream ended without a final object'
+            else:
+                json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        status = e.code
+        error = f'HTTP {e.code}'
+        e.read()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return Sample(time.perf_counter() - started, ttft, status, error)
+
+def summarize(level, samples, elapsed, coalesced=None):
+    """Aggregate one level's samples into a result dict (latencies in ms)"""
+    ok = sorted(s.latency * 1000 for s in samples if s.error is None)
+    ttfts = sorted(s.ttft * 1000 for s in samples if s.error is None and s.ttft is not None)
+    total = len(samples)
+    errors = sum(1 for s in samples if s.error is not None)
+    throttled = sum(1 for s in samples if s.status == 429)
+    return {
+        'level': level,
+        'requests': total,
+        'ok': len(ok),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+        'p50_ms': percentile(ok, 50),
+        'p95_ms': percentile(ok, 95),
+        'p99_ms': percentile(ok, 99),
+        'max_ms': ok[-1] if ok else None,
+        'ttft_p50_ms': percentile(ttfts, 50),
+        'ttft_p95_ms': percentile(ttfts, 95),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'rate_429': round(throttled / total, 4) if total else 0.0,
+        'coalesced': coalesced,
+        'errors': sorted({s.error for s in samples if s.error is not None})[:5]
+    }
+
+def run_closed(url, payloads, concurrency, duration, max_requests, stream, timeout):
+    """concurrency clients in a loop until duration seconds or max_requests requests"""
+    samples = []
+    lock = threading.Lock()
+    counter = iter(range(max_requests or sys.maxsize))
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        index = offset
+        while time.perf_counter() < stop_at:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            sample = send_request(url, payloads[index % len(payloads)], stream, timeout)
+            index += concurrency
+            with lock:
+                samples.append(sample)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+def run_open(url, payloads, rate, duration, max_requests, stream, timeout, max_inflight):
+    """Poisson arrivals at rate requests/second for duration seconds"""
+    samples = []
+    lock = threading.Lock()
+
+    def fire(index, scheduled):
+        sample = send_request(url, payloads[index % len(payloads)], stream, timeout, started=scheduled)
+        with lock:
+            samples.append(sample)
+
+    started = time.perf_counter()
+    arrival = started
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        for index in range(max_requests or sys.maxsize):
+            arrival += random.expovariate(rate)
+            if arrival - started >= duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Requests the pool cannot start yet wait in its queue; their
+            # latency still counts from the scheduled arrival
+            pool.submit(fire, index, arrival)
+    return samples, time.perf_counter() - started
+
+def find_knee(results, min_gain=0.1):
+    """
+    Saturation knee of a sweep: the last level whose successor adds less than
+    min_gain relative throughput (or the last level if throughput keeps rising)
+    """
+    for current, following in zip(results, results[1:]):
+        if current['throughput'] <= 0:
+            continue
+        if (following['throughput'] - current['throughput']) / current['throughput'] < min_gain:
+            return current['level']
+    return results[-1]['level'] if results else None
+
+def coalesced_count(base_url, timeout):
+    """Total coalesced requests reported by /api/ocr/status (None if unavailable)"""
+    try:
+        with urllib.request.urlopen(base_url + '/api/ocr/status', timeout=timeout) as resp:
+            return json.loads(resp.read()).get('inflight', {}).get('coalesced')
+    except Exception:
+        return None
+
+def wait_ready(base_url, timeout):
+    """Poll /api/ocr/health until the backend reports ready"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(base_url + '/api/ocr/health', timeout=5) as resp:
+                if resp.status == 200:
+                    return True
+        except Exception:
+            pass
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(1)
+
+def format_ms(value):
+    return '-' if value is None else f'{value:.0f}'
+
+def print_table(results, mode):
+    header = (f"{mode:>11} {'reqs':>6} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} "
+              f"{'ttft50':>7} {'ttft95':>7} {'err%':>6} {'429%':>6}")
+    print(header)
+    for r in results:
+        print(f"{r['level']:>11} {r['requests']:>6} {r['throughput']:>7.2f} {format_ms(r['p50_ms']):>7} "
+              f"{format_ms(r['p95_ms']):>7} {format_ms(r['p99_ms']):>7} {format_ms(r['max_ms']):>7} "
+              f"{format_ms(r['ttft_p50_ms']):>7} {format_ms(r['ttft_p95_ms']):>7} "
+              f"{r['error_rate'] * 100:>6.1f} {r['rate_429'] * 100:>6.1f}")
+        for error in r['errors']:
+            print(f"{'':>11}   error: {error}")
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Fake backend: fixed per-token cost, limited workers, 429 when its queue is full"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith('/api/ocr/health'):
+            self.send_json(200, {'status': 'healthy', 'ready': True})
+        elif self.path.startswith('/api/ocr/status'):
+            self.send_json(200, {'model_state': 'ready', 'inflight': {'coalesced': 0}})
+        else:
+            self.send_json(404, {'success': False, 'message': 'Not found'})
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path not in ('/api/ocr/extract', '/api/ocr/extract/stream'):
+            self.send_json(404, {'success': False, 'message': 'Not found'})
+            return
+        with server.lock:
+            if server.waiting >= server.queue_limit:
+                self.send_json(429, {'success': False, 'message': 'Too many requests'})
+                return
+            server.waiting += 1
+        with server.slots:
+            with server.lock:
+                server.waiting -= 1
+            stream = self.path.endswith('/stream')
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+            for _ in range(server.tokens):
+                time.sleep(server.token_seconds)
+                if stream:
+                    self.wfile.write(b'{"token": "x"}\n')
+                    self.wfile.flush()
+            result = {'success': True, 'raw_result': 'x' * server.tokens, 'tokens': server.tokens}
+            if stream:
+                self.wfile.write(json.dumps({'done': True, **result}).encode('utf-8') + b'\n')
+            else:
+                self.send_json(200, result)
+
+def start_stub_server(workers=2, token_ms=5.0, tokens=20, queue_limit=32, port=0):
+    """Serve StubHandler on localhost in a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.slots = threading.Semaphore(workers)
+    server.lock = threading.Lock()
+    server.waiting = 0
+    server.queue_limit = queue_limit
+    server.token_seconds = token_ms / 1000
+    server.tokens = tokens
+    threading.Thread(target=server.serve_forever, name='stub-backend', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def parse_levels(text):
+    return [float(v) if '.' in v else int(v) for v in text.split(',') if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the MixTeX OCR backend')
+    parser.add_argument('--url', default='http://localhost:5001', help='backend base URL')
+    parser.add_argument('--images', nargs='*', default=[], help='image files, directories or .mxshard shards')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=parse_levels, help='closed-loop client counts, e.g. 1,2,4,8')
+    mode.add_argument('--rate', type=parse_levels, help='open-loop arrival rates in requests/second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per level')
+    parser.add_argument('--requests', type=int, default=0, help='stop a level after this many requests')
+    parser.add_argument('--warmup', type=int, default=2, help='unrecorded requests before the first level')
+    parser.add_argument('--stream', action='store_true', help='use /api/ocr/extract/stream and report TTFT')
+    parser.add_argument('--timeout', type=float, default=120, help='per-request timeout in seconds')
+    parser.add_argument('--max-inflight', type=int, default=256, help='open-loop cap on concurrent requests')
+    parser.add_argument('--knee-gain', type=float, default=0.1,
+                        help='relative throughput gain below which the sweep is saturated')
+    parser.add_argument('--preprocessing-level', default='moderate')
+    parser.add_argument('--max-tokens', help='forwarded as max_tokens (integer or "auto")')
+    parser.add_argument('--deadline-ms', type=float, help='forwarded as deadline_ms')
+    parser.add_argument('--wait-ready', type=float, default=300, help='seconds to wait for /api/ocr/health')
+    parser.add_argument('--json', help='write the results to this file')
+    stub = parser.add_argument_group('stub server (tests the harness without a model)')
+    stub.add_argument('--stub', action='store_true', help='run against a built-in fake backend')
+    stub.add_argument('--stub-workers', type=int, default=2)
+    stub.add_argument('--stub-token-ms', type=float, default=5.0)
+    stub.add_argument('--stub-tokens', type=int, default=20)
+    stub.add_argument('--stub-queue', type=int, default=32, help='waiting requests before the stub answers 429')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    if args.stub:
+        _, base_url = start_stub_server(args.stub_workers, args.stub_token_ms, args.stub_tokens, args.stub_queue)
+        print(f'Stub backend on {base_url}')
+
+    corpus = load_corpus(args.images)
+    if not corpus:
+        if not args.stub:
+            parser.error('no images found; pass --images (or --stub)')
+        corpus = ['data:image/png;base64,' + BLANK_PNG]
+
+    options = {'preprocessing_level': args.preprocessing_level}
+    if args.max_tokens is not None:
+        options['max_tokens'] = args.max_tokens if args.max_tokens == 'auto' else int(args.max_tokens)
+    if args.deadline_ms is not None:
+        options['deadline_ms'] = args.deadline_ms
+    payloads = [json.dumps({'image_data': image, **options}).encode('utf-8') for image in corpus]
+    url = base_url + ('/api/ocr/extract/stream' if args.stream else '/api/ocr/extract')
+
+    if not wait_ready(base_url, args.wait_ready):
+        sys.exit(f'Backend at {base_url} did not become ready within {args.wait_ready:.0f}s')
+    for i in range(args.warmup):
+        send_request(url, payloads[i % len(payloads)], args.stream, args.timeout)
+
+    mode_name = 'rate' if args.rate else 'concurrency'
+    levels = args.rate or args.concurrency or [1]
+    print(f'{len(corpus)} images, {args.duration:.0f}s per level, {url}')
+    results = []
+    for level in levels:
+        before = coalesced_count(base_url, args.timeout)
+        if args.rate:
+            samples, elapsed = run_open(url, payloads, level, args.duration, args.requests, args.stream,
+                                        args.timeout, args.max_inflight)
+        else:
+            samples, elapsed = run_closed(url, payloads, level, args.duration, args.requests, args.stream,
+                                          args.timeout)
+        after = coalesced_count(base_url, args.timeout)
+        coalesced = after - before if before is not None and after is not None else None
+        results.append(summarize(level, samples, elapsed, coalesced))
+        print(f"  {mode_name} {level}: {results[-1]['throughput']:.2f} req/s, p95 {format_ms(results[-1]['p95_ms'])} ms")
+
+    print()
+    print_table(results, mode_name)
+    report = {'url': url, 'mode': mode_name, 'images': len(corpus), 'results': results}
+    if len(results) > 1:
+        report['knee'] = find_knee(results, args.knee_gain)
+        if report['knee'] == results[-1]['level']:
+            print(f"\nNo saturation knee: throughput still rising at {mode_name} {report['knee']}")
+        else:
+            print(f"\nSaturation knee: {mode_name} {report['knee']} "
+                  f"(the next level adds < {args.knee_gain:.0%} throughput)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.json}')
+
+if __name__ == '__main__':
+    main()
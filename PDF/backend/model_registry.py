@@ -0,0 +1,253 @@
+"""
+Versioned model registry with background loading and hot swap.
+
+Each loaded model is a ModelVersion. A new version is loaded and warmed on
+a background thread while the current one keeps serving; promoting it is a
+single reference swap under the registry lock, so every request runs on
+exactly one version from start to finish. The replaced version is drained:
+it stops receiving new requests, and once its last in-flight request has
+released it the model is dropped so its sessions and weights are freed.
+
+A candidate version can also take a percentage of live traffic (a canary);
+per-version latency statistics make the two comparable side by side.
+"""
+
+import gc
+import itertools
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class UnknownVersion(KeyError):
+    """No model version with the requested name."""
+
+
+class ModelVersion:
+    """
+    One model: where it was loaded from, its lifecycle state and its traffic.
+    state: 'loading' -> 'warming' -> 'ready' -> 'draining' -> 'retired', or 'error'
+    """
+
+    def __init__(self, name, model_dir, options):
+        self.name = name
+        self.model_dir = model_dir
+        self.options = options
+        self.model = None
+        self.state = 'loading'
+        self.error = None
+        # Retired while still loading: freed as soon as the load finishes, never activated
+        self.retire_requested = False
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=1000)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(1000 * latencies[max(1, math.ceil(q / 100 * len(latencies))) - 1], 1)
+
+        return {
+            'name': self.name,
+            'model_dir': self.model_dir,
+            'options': self.options,
+            'state': self.state,
+            'retire_requested': self.retire_requested,
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'active_requests': self.active,
+            'requests': self.requests,
+            'failures': self.failures,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95)
+        }
+
+
+class ModelRegistry:
+    """
+    load(model_dir, **options) -> model and warm(model) do the actual work;
+    the registry only tracks versions and routes requests between them.
+    """
+
+    def __init__(self, load, warm=None):
+        self._load = load
+        self._warm = warm
+        self._lock = threading.Condition()
+        self._versions = {}
+        self._counter = itertools.count(1)
+        self.current = None
+        self.canary = None
+        self.canary_percent = 0.0
+
+    def get(self, name):
+        with self._lock:
+            try:
+                return self._versions[name]
+            except KeyError:
+                raise UnknownVersion(name) from None
+
+    def load(self, model_dir, options=None, name=None, background=True, on_ready=None):
+        """
+        Register a new version and load + warm it (on a thread unless
+        background is False). on_ready(version) is called once it is ready,
+        e.g. to promote it or to make it the canary.
+        """
+        with self._lock:
+            name = name or f'v{next(self._counter)}'
+            if name in self._versions and self._versions[name].state != 'retired':
+                raise ValueError(f'model version {name!r} already exists')
+            version = ModelVersion(name, model_dir, dict(options or {}))
+            self._versions[name] = version
+
+        def run():
+            try:
+                started = time.perf_counter()
+                model = self._load(model_dir, **version.options)
+                version.load_seconds = round(time.perf_counter() - started, 3)
+                if self._warm is not None and not version.retire_requested:
+                    version.state = 'warming'
+                    started = time.perf_counter()
+                    self._warm(model)
+                    version.warmup_seconds = round(time.perf_counter() - started, 3)
+                with self._lock:
+                    retired = version.retire_requested
+                    if retired:
+                        version.state = 'retired'
+                    else:
+                        version.model = model
+                        version.state = 'ready'
+                    self._lock.notify_all()
+            except Exception as e:
+                with self._lock:
+                    version.state = 'error'
+                    version.error = f'{type(e).__name__}: {e}'
+                    self._lock.notify_all()
+                return
+            if retired:
+                del model
+                gc.collect()
+            elif on_ready is not None:
+                on_ready(version)
+
+        if background:
+            threading.Thread(target=run, name=f'model-load-{name}', daemon=True).start()
+        else:
+            run()
+        return version
+
+    def wait_loaded(self, version, timeout=None):
+        """Block until version has finished loading and warming; returns its state."""
+        with self._lock:
+            self._lock.wait_for(lambda: version.state not in ('loading', 'warming'), timeout)
+            return version.state
+
+    def promote(self, name):
+        """Route all new requests to version name and drain the one it replaces."""
+        with self._lock:
+            version = self._ready(name)
+            previous, self.current = self.current, version
+            if self.canary is version:
+                self.canary, self.canary_percent = None, 0.0
+        if previous is not None and previous is not version:
+            self.retire(previous.name)
+        return version
+
+    def set_canary(self, name, percent):
+        """Send percent (0-100) of new requests to version name; percent 0 (or name None) stops it."""
+        with self._lock:
+            if name is None or percent <= 0:
+                self.canary, self.canary_percent = None, 0.0
+                return None
+            version = self._ready(name)
+            if version is self.current:
+                raise ValueError(f'{name!r} is already the current version')
+            self.canary, self.canary_percent = version, min(float(percent), 100.0)
+            return version
+
+    def retire(self, name):
+        """
+        Stop routing to version name and free it once its in-flight requests
+        finish; a version still loading is freed when its load completes.
+        """
+        with self._lock:
+            version = self.get(name)
+            if version is self.current:
+                raise ValueError(f'{name!r} is the current version; promote another one first')
+            if self.canary is version:
+                self.canary, self.canary_percent = None, 0.0
+            if version.state in ('loading', 'warming'):
+                version.retire_requested = True
+                return version
+            if version.state not in ('ready', 'error'):
+                return version
+            version.state = 'draining'
+
+        def drain():
+            with self._lock:
+                self._lock.wait_for(lambda: version.active == 0)
+                version.model = None
+                version.state = 'retired'
+            gc.collect()
+
+        threading.Thread(target=drain, name=f'model-drain-{name}', daemon=True).start()
+        return version
+
+    def _ready(self, name):
+        version = self.get(name)
+        if version.state != 'ready':
+            raise ValueError(f'model version {name!r} is not ready (state: {version.state})')
+        return version
+
+    def route(self):
+        """The version a new request should run on (the canary for canary_percent of them)."""
+        with self._lock:
+            if self.canary is not None and random.random() * 100 < self.canary_percent:
+                return self.canary
+            return self.current
+
+    @contextmanager
+    def lease(self, version=None):
+        """
+        Hold a version for the duration of one request so it is not freed
+        underneath it. A version that was retired since it was routed to is
+        replaced by the current one. Records the request's latency.
+        """
+        with self._lock:
+            if version is None or version.state not in ('ready', 'draining'):
+                version = self.current
+            if version is None:
+                raise RuntimeError('no model version is loaded')
+            version.active += 1
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield version
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                version.active -= 1
+                version.requests += 1
+                version.failures += failed
+                version.latencies.append(time.perf_counter() - started)
+                self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'current': self.current.name if self.current else None,
+                'canary': self.canary.name if self.canary else None,
+                'canary_percent': self.canary_percent,
+                'versions': [version.stats() for version in self._versions.values()]
+            }
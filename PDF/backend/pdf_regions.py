@@ -0,0 +1,250 @@
+"""
+Server-side rasterization of PDF selections.
+
+The browser uploads a PDF once; it is stored under its SHA-256, so the
+client can ask whether the server already has it before sending anything.
+OCR requests then only carry (doc_id, page, bbox) and the server renders
+that region itself, at the resolution the model needs rather than at the
+viewer's zoom.
+
+Rendered pages are kept in an LRU cache at a fixed zoom and regions are
+cropped from them, so repeated selections on one page render it only once;
+cropped regions have an LRU cache of their own. The stored files are
+capped too (max_bytes / max_files): each use refreshes a file's mtime and
+the least recently used ones are deleted when an upload goes over a cap.
+
+Requires PyMuPDF (pip install pymupdf). Without it PdfStore.available is
+False and the backend keeps accepting image uploads only.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+try:
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz  # PyMuPDF before 1.24
+    except ImportError:
+        fitz = None
+
+
+class PdfNotFound(KeyError):
+    """No PDF with the requested doc_id has been uploaded."""
+
+
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def discard(self, predicate):
+        """Drop every entry whose key satisfies predicate."""
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
+
+
+class PdfStore:
+    """
+    storage_dir: where uploaded PDFs are kept, as <sha256>.pdf
+    page_zoom: zoom of cached page rasters (1.0 = 72 dpi); also the largest
+        zoom a region is rendered at
+    target_size: the model's input size; regions are scaled to fit it
+    max_bytes, max_files: caps on the stored PDFs (None: unlimited); the
+        least recently used are deleted first, never the one just uploaded
+    """
+
+    def __init__(self, storage_dir, page_zoom=2.0, target_size=(448, 448), max_open=4, page_cache_size=8,
+                 region_cache_size=64, max_bytes=None, max_files=None):
+        self.storage_dir = storage_dir
+        self.page_zoom = page_zoom
+        self.target_size = target_size
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.documents = LRUCache(max_open)
+        self.pages = LRUCache(page_cache_size)
+        self.regions = LRUCache(region_cache_size)
+        self.evicted = 0
+        # PyMuPDF objects must not be used from several threads at once
+        self._fitz_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+    @property
+    def available(self):
+        return fitz is not None
+
+    def path(self, doc_id):
+        if len(doc_id) != 64 or any(c not in '0123456789abcdef' for c in doc_id):
+            raise PdfNotFound(doc_id)
+        return os.path.join(self.storage_dir, f'{doc_id}.pdf')
+
+    def has(self, doc_id):
+        try:
+            return self._touch(self.path(doc_id))
+        except PdfNotFound:
+            return False
+
+    def _touch(self, path):
+        """Mark a stored PDF as used (eviction goes by mtime); False if it is not stored."""
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def add(self, pdf_bytes):
+        """Store a PDF (a no-op if it is already stored); returns (doc_id, page_count)"""
+        doc_id = hashlib.sha256(pdf_bytes).hexdigest()
+        if not self.has(doc_id):
+            # Open it first so that non-PDF uploads are rejected, not stored
+            with self._fitz_lock:
+                document = fitz.open(stream=pdf_bytes, filetype='pdf')
+            os.makedirs(self.storage_dir, exist_ok=True)
+            tmp_path = self.path(doc_id) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, self.path(doc_id))
+            self.documents.put(doc_id, document)
+            self._evict(keep=doc_id)
+        return doc_id, self.page_count(doc_id)
+
+    def _stored(self):
+        """(mtime, size, doc_id) of every stored PDF, least recently used first"""
+        entries = []
+        try:
+            names = os.listdir(self.storage_dir)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith('.pdf'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.storage_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-len('.pdf')]))
+        return sorted(entries)
+
+    def _evict(self, keep):
+        with self._disk_lock:
+            entries = self._stored()
+            total = sum(size for _, size, _ in entries)
+            count = len(entries)
+            for _, size, doc_id in entries:
+                if (self.max_bytes is None or total <= self.max_bytes) and (
+                        self.max_files is None or count <= self.max_files):
+                    break
+                if doc_id == keep:
+                    continue
+                try:
+                    os.remove(self.path(doc_id))
+                except (OSError, PdfNotFound):
+                    continue
+                total -= size
+                count -= 1
+                self.evicted += 1
+                self.documents.discard(lambda key: key == doc_id)
+                self.pages.discard(lambda key: key[0] == doc_id)
+                self.regions.discard(lambda key: key[0] == doc_id)
+
+    def document(self, doc_id):
+        document = self.documents.get(doc_id)
+        if document is None:
+            path = self.path(doc_id)
+            if not os.path.exists(path):
+                raise PdfNotFound(doc_id)
+            with self._fitz_lock:
+                document = fitz.open(path)
+            self.documents.put(doc_id, document)
+        return document
+
+    def page_count(self, doc_id):
+        return self.document(doc_id).page_count
+
+    def page_image(self, doc_id, page):
+        """Page raster at page_zoom (page numbers start at 1)"""
+        key = (doc_id, page)
+        image = self.pages.get(key)
+        if image is None:
+            document = self.document(doc_id)
+            if not 1 <= page <= document.page_count:
+                raise ValueError(f'page must be between 1 and {document.page_count}')
+            with self._fitz_lock:
+                pixmap = document[page - 1].get_pixmap(matrix=fitz.Matrix(self.page_zoom, self.page_zoom),
+                                                       alpha=False)
+                image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+            self.pages.put(key, image)
+        return image
+
+    def render_region(self, doc_id, page, bbox):
+        """
+        Render bbox = [x0, y0, x1, y1] of a page, given as fractions of the
+        page size (origin top left), scaled to fit target_size
+        """
+        x0, y0, x1, y1 = (min(max(float(v), 0.0), 1.0) for v in bbox)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError('bbox must be [x0, y0, x1, y1] with x0 < x1 and y0 < y1')
+        # Keep the file recently used even when every render is a cache hit
+        if not self._touch(self.path(doc_id)):
+            raise PdfNotFound(doc_id)
+        # Round so that near-identical selections share a cache entry
+        key = (doc_id, page, round(x0, 4), round(y0, 4), round(x1, 4), round(y1, 4))
+        region = self.regions.get(key)
+        if region is None:
+            page_image = self.page_image(doc_id, page)
+            width, height = page_image.size
+            box = (int(x0 * width), int(y0 * height), max(int(x1 * width), int(x0 * width) + 1),
+                   max(int(y1 * height), int(y0 * height) + 1))
+            region = page_image.crop(box)
+            # Downscale to the model's input size here, once; pad_image then only pads
+            scale = min(self.target_size[0] / region.width, self.target_size[1] / region.height)
+            if scale < 1:
+                region = region.resize((max(1, int(region.width * scale)), max(1, int(region.height * scale))),
+                                       Image.Resampling.LANCZOS)
+            self.regions.put(key, region)
+        return region
+
+    def stats(self):
+        with self._disk_lock:
+            entries = self._stored()
+        return {
+            'available': self.available,
+            'stored': {
+                'files': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_files': self.max_files,
+                'max_bytes': self.max_bytes,
+                'evicted': self.evicted
+            },
+            'open_documents': self.documents.stats(),
+            'page_cache': self.pages.stats(),
+            'region_cache': self.regions.stats()
+        }
@@ -0,0 +1,149 @@
+"""
+Single-flight coalescing of identical in-flight OCR requests.
+
+Requests that hash to the same key while a computation for that key is
+still running attach to it instead of starting their own. Computations run
+on a bounded thread pool, so a disconnecting client never stalls the others
+and a burst of distinct requests queues instead of starting unlimited
+concurrent model runs. Every caller (the first one included) is just a
+subscriber that gets the final result, or replays the token stream from
+the start; once the last subscriber has left, the computation is cancelled.
+"""
+
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request_key(image, options):
+    """Hash decoded pixel content plus the options that affect the output."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode('utf-8'))
+    digest.update(image.tobytes())
+    digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class FlightCancelled(Exception):
+    """Raised inside a computation whose subscribers have all left."""
+
+
+class Flight:
+    """One running computation: its token stream so far and its outcome."""
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.subscribers = 1
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def publish(self, token):
+        with self._cond:
+            if self.cancelled:
+                raise FlightCancelled('all clients of this request disconnected')
+            self.tokens.append(token)
+            self._cond.notify_all()
+
+    def _subscribe(self):
+        with self._cond:
+            if self.cancelled:
+                return False
+            self.subscribers += 1
+            return True
+
+    def leave(self):
+        """A subscriber is done with this flight; the last one to leave early cancels it."""
+        with self._cond:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.cancelled = True
+
+    def _finish(self, result=None, error=None):
+        with self._cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self):
+        """Block until the computation finishes; return its result or raise its error."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def stream(self):
+        """Yield every token from the first one, then return when the computation ends."""
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.done or len(self.tokens) > sent)
+                pending = self.tokens[sent:]
+                finished = self.done
+            for token in pending:
+                yield token
+            sent += len(pending)
+            if finished and sent == len(self.tokens):
+                return
+
+
+class SingleFlight:
+    def __init__(self, max_concurrent=4):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='ocr')
+        self.max_concurrent = max_concurrent
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def join(self, key, compute):
+        """
+        Return the flight for key, queueing compute(publish) on the pool if
+        none is running. compute must return the final result; publish
+        raises FlightCancelled once every subscriber has left. Each caller
+        must call flight.leave() when done with it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight._subscribe():
+                self.coalesced += 1
+                return flight
+            flight = Flight()
+            self._flights[key] = flight
+            self.started += 1
+
+        def run():
+            try:
+                if flight.cancelled:
+                    raise FlightCancelled('all clients of this request disconnected')
+                result = compute(flight.publish)
+            except Exception as e:
+                error = e
+                result = None
+            else:
+                error = None
+            with self._lock:
+                # A cancelled flight may already have been replaced under its key
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                self.cancelled += isinstance(error, FlightCancelled)
+            flight._finish(result, error)
+
+        self._executor.submit(run)
+        return flight
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._flights),
+                'max_concurrent': self.max_concurrent,
+                'started': self.started,
+                'coalesced': self.coalesced,
+                'cancelled': self.cancelled
+            }
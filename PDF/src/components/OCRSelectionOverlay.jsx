@@ -92,6 +92,7 @@ const OCRSelectionOverlay = ({
 
       // Find which page the selection is on - using viewport-based detection
       let targetCanvas = null;
+      let pageNumber = null;
       let relativeY = selection.y;
       let relativeX = selection.x;
       let candidateCanvases = [];
@@ -158,6 +159,7 @@ const OCRSelectionOverlay = ({
         const chosenCandidate = visibleCandidates.length > 0 ? visibleCandidates[0] : candidateCanvases[0];
         
         targetCanvas = chosenCandidate.canvas;
+        pageNumber = chosenCandidate.pageNumber;
         relativeY = chosenCandidate.relativeY;
         relativeX = chosenCandidate.relativeX;
         
@@ -337,7 +339,15 @@ const OCRSelectionOverlay = ({
           width: actualWidth,
           height: actualHeight
         },
-        selectionRect: selection
+        selectionRect: selection,
+        // Page and region as fractions of the page, for server-side rendering
+        pageNumber,
+        pageBox: [
+          actualX / targetCanvas.width,
+          actualY / targetCanvas.height,
+          (actualX + actualWidth) / targetCanvas.width,
+          (actualY + actualHeight) / targetCanvas.height
+        ]
       };
       
       console.log('🚀 Sending selection data to parent component');
@@ -54,6 +54,7 @@ const PdfViewer = () => {
   const [showOcrSidebar, setShowOcrSidebar] = useState(false);
   const [ocrLoading, setOcrLoading] = useState(false);
   const [ocrBackendStatus, setOcrBackendStatus] = useState('checking');
+  const [ocrDocId, setOcrDocId] = useState(null); // PDF registered with the OCR backend
   
   const containerRef = useRef(null);
 
@@ -99,6 +100,10 @@ const PdfViewer = () => {
       setLoadingMessage('Loading PDF document...');
       
       setFile(selectedFile);
+      
+      // Register the PDF with the OCR backend so selections can be sent as page + bbox
+      setOcrDocId(null);
+      ocrAPI.registerPdf(selectedFile).then(setOcrDocId);
     }
   };
 
@@ -581,7 +586,17 @@ const PdfViewer = () => {
     
     try {
       console.log('📡 Sending request to OCR API...');
-      const results = await ocrAPI.extractContent(selectionData.imageData, preprocessingLevel);
+      let results = null;
+      if (ocrDocId && selectionData.pageNumber && selectionData.pageBox) {
+        try {
+          results = await ocrAPI.extractRegion(ocrDocId, selectionData.pageNumber, selectionData.pageBox, preprocessingLevel);
+        } catch (error) {
+          console.warn('⚠️ PDF region extraction failed, sending the captured image instead:', error);
+        }
+      }
+      if (!results) {
+        results = await ocrAPI.extractContent(selectionData.imageData, preprocessingLevel);
+      }
       console.log('📥 OCR API Response:', results);
       
       // Always set results regardless of success status
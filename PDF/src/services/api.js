@@ -142,6 +142,66 @@ export const ocrAPI = {
     }
   },
 
+  // Upload a PDF once for server-side region extraction. Returns its doc_id
+  // (the file's SHA-256), or null if the backend cannot render PDFs, in which
+  // case selections are sent as images as before.
+  registerPdf: async (file) => {
+    try {
+      const buffer = await file.arrayBuffer();
+      const digest = await crypto.subtle.digest('SHA-256', buffer);
+      const docId = Array.from(new Uint8Array(digest))
+        .map(byte => byte.toString(16).padStart(2, '0'))
+        .join('');
+
+      // Skip the upload if the server already has this file
+      const existing = await fetch(`${OCR_API_BASE_URL}/pdf/${docId}`);
+      if (existing.ok) {
+        return docId;
+      }
+
+      const response = await fetch(`${OCR_API_BASE_URL}/pdf`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/pdf',
+        },
+        body: buffer
+      });
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const data = await response.json();
+      console.log('📄 PDF registered for OCR:', { docId: data.doc_id, pages: data.pages });
+      return data.doc_id;
+    } catch (error) {
+      console.error('Error registering PDF for OCR:', error);
+      return null;
+    }
+  },
+
+  // Extract mathematical content from a region of a registered PDF.
+  // bbox is [x0, y0, x1, y1] as fractions of the page size; the server
+  // renders the region itself, so only these few numbers are sent.
+  extractRegion: async (docId, pageNumber, bbox, preprocessingLevel = 'moderate') => {
+    const response = await fetch(`${OCR_API_BASE_URL}/extract`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        pdf: { doc_id: docId, page: pageNumber, bbox },
+        preprocessing_level: preprocessingLevel
+      })
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    return response.json();
+  },
+
   // Check OCR system status
   checkStatus: async () => {
     try {
@@ -1,9 +1,16 @@
 import re
 import random
 import string
+import bisect
+import gzip
+import json
 from tqdm import tqdm
 import jieba
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'mixtexgui', 'examples'))
+from mixtex_shard import ShardWriter
 
 # Function to remove non-English characters from a text file
 # Input:
@@ -19,24 +26,96 @@ def remove_non_english_characters(input_file_path, output_file_path):
     with open(output_file_path, 'w', encoding='utf-8') as file:
         file.write(cleaned_content)
 
+# Deduplicated bank of LaTeX formulas indexed by length
+# Formulas are kept sorted by length so that every length range maps to a
+# contiguous slice; _starts[n] is the index of the first formula with len >= n.
+# Drawing from a range is therefore a single randrange instead of sampling
+# from the whole list and rejecting unsuitable lengths.
+# Input:
+#   formulas (iterable): LaTeX formulas, already stripped of \tag{} and \eqref{}
+class FormulaBank:
+    VERSION = 1
+
+    def __init__(self, formulas):
+        self.formulas = sorted(set(formulas), key=lambda f: (len(f), f))
+        lengths = [len(f) for f in self.formulas]
+        max_len = lengths[-1] if lengths else 0
+        self._starts = [bisect.bisect_left(lengths, n) for n in range(max_len + 2)]
+
+    def __len__(self):
+        return len(self.formulas)
+
+    # Function to get the slice of formulas with min_len <= len < max_len
+    # Output:
+    #   (lo, hi) (tuple): Index range into self.formulas
+    def span(self, min_len=0, max_len=None):
+        last = len(self._starts) - 1
+        lo = self._starts[min(max(min_len, 0), last)]
+        hi = len(self.formulas) if max_len is None else self._starts[min(max(max_len, 0), last)]
+        return lo, max(lo, hi)
+
+    # Function to get the share of the bank within a length range
+    # Used by callers to keep the old accept rate of rejection sampling.
+    def fraction(self, min_len=0, max_len=None):
+        if not self.formulas:
+            return 0.0
+        lo, hi = self.span(min_len, max_len)
+        return (hi - lo) / len(self.formulas)
+
+    # Function to draw a random formula with min_len <= len < max_len
+    # Output:
+    #   formula (str or None): None if no formula falls in the range
+    def draw(self, min_len=0, max_len=None):
+        lo, hi = self.span(min_len, max_len)
+        if lo == hi:
+            return None
+        return self.formulas[random.randrange(lo, hi)]
+
+    # Function to persist the bank as gzip-compressed JSON
+    def save(self, bank_path):
+        payload = {'version': self.VERSION, 'formulas': self.formulas}
+        with gzip.open(bank_path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+    # Function to load a bank written by save()
+    @classmethod
+    def load(cls, bank_path):
+        with gzip.open(bank_path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('version') != cls.VERSION:
+            raise ValueError(f'Unsupported formula bank version: {payload.get("version")}')
+        return cls(payload['formulas'])
+
 # Function to extract LaTeX formulas from a .tex file
 # Input:
 #   tex_file_path (str): Path to the LaTeX (.tex) file
+#   bank_path (str, optional): Cache file for the formula bank; reused while
+#     it is newer than the .tex file, rebuilt and rewritten otherwise
 # Output:
-#   formula_list (list): List of extracted LaTeX formulas
-def extract_latex_formulas(tex_file_path):
+#   bank (FormulaBank): Deduplicated formulas without \tag{} and \eqref{}
+def extract_latex_formulas(tex_file_path, bank_path=None):
+    if bank_path and os.path.exists(bank_path) and \
+            os.path.getmtime(bank_path) >= os.path.getmtime(tex_file_path):
+        try:
+            return FormulaBank.load(bank_path)
+        except (OSError, ValueError, KeyError):
+            pass
     with open(tex_file_path, 'r', encoding='utf-8') as f:
         tex_content = f.read()
     pattern = r'\\\[(.+?)\\\]|\\begin{align\*}(.+?)\\end{align\*}'
     formulas = re.findall(pattern, tex_content)
-    formula_list = [re.sub(r'\\eqref\{(.*?)\}', r'', group) for tuples in formulas for group in tuples if group]
-    return formula_list
+    strip_pattern = re.compile(r'\\eqref\{.*?\}|\\tag\{.*?\}')
+    formula_list = [strip_pattern.sub('', group) for tuples in formulas for group in tuples if group]
+    bank = FormulaBank(f for f in formula_list if f.strip())
+    if bank_path:
+        bank.save(bank_path)
+    return bank
 
 # Function to process text by inserting LaTeX formulas randomly
 # Input:
 #   input_file (str): Path to the input text file
 #   output_file (str): Path to save the processed text file
-#   formulas (list): List of LaTeX formulas to insert
+#   formulas (FormulaBank): Formula bank to draw from
 # Output:
 #   None (writes the processed content to output_file)
 def process_text(input_file, output_file, formulas):
@@ -45,18 +124,15 @@ def process_text(input_file, output_file, formulas):
     text = text.replace('\n', '')
     sentences = re.split(r'[.,]', text)
     output = ''
+    # Insert with the same probability rejection sampling used to accept
+    insert_rate = 0.02 * formulas.fraction(max_len=50)
     
     with open(output_file, 'w', encoding='utf-8') as f:
         for sentence in sentences:
             for char in sentence:
                 output += char
-                if random.random() < 0.02:
-                    formula = random.sample(formulas, 1)[0]
-                    if len(formula) < 50:
-                        try:
-                            output += ' \\(' + re.sub(r'\\tag\{.*?\}', '', formula) + '\\) '
-                        except:
-                            print(formula)
+                if random.random() < insert_rate:
+                    output += ' \\(' + formulas.draw(max_len=50) + '\\) '
             if 30 < len(output) < 300:
                 f.write(output + '.\n')
                 output = ''
@@ -76,13 +152,15 @@ def remove_symbols(text):
 # Function to format words with LaTeX commands and randomly insert formulas and numbers
 # Input:
 #   words (list): List of words to format
-#   formulas (list): List of LaTeX formulas to insert
+#   formulas (FormulaBank): Formula bank to draw from
 #   lines (list): List of lines from the original text for random insertion
 # Output:
 #   output (str): The formatted LaTeX string
 def format_text_with_latex(words, formulas, lines):
     output = ''
     count = 0
+    long_share = formulas.fraction(min_len=31)
+    short_share = formulas.fraction(max_len=30)
     for char in tqdm(words):
         count += 1
         if len(char) >= 2 and random.random() < 0.01:
@@ -96,15 +174,13 @@ def format_text_with_latex(words, formulas, lines):
             output += '\n \\newpage \n'
         if random.random() < 0.5:
             if random.random() < 0.03:
-                formula = random.sample(formulas, 1)[0]
-                if random.random() < 0.03:
-                    formula += '\\tag{' + str(random.randint(0, 20)) + '.' + str(random.randint(0, 20)) + '}'
-                if len(formula) > 30:
+                if random.random() < long_share:
+                    formula = formulas.draw(min_len=31)
+                    if random.random() < 0.03:
+                        formula += '\\tag{' + str(random.randint(0, 20)) + '.' + str(random.randint(0, 20)) + '}'
                     output += '\n \\begin{align*} \n' + formula + '\n \\end{align*} \n'
-            else:
-                formula = random.sample(formulas, 1)[0]
-                if len(formula) < 30:
-                    output += ' \\( ' + re.sub(r'\\tag\{.*?\}', '', formula) + ' \\) '
+            elif random.random() < short_share:
+                output += ' \\( ' + formulas.draw(max_len=30) + ' \\) '
         elif random.random() < 0.007:
             output += ' \\(' + str(random.randint(-1000, 1000)) + '\\) '
         elif random.random() < 0.007:
@@ -124,19 +200,16 @@ def format_text_with_latex(words, formulas, lines):
                 output += ' \\textit{' + char + '} '
     return output
 
-# Function to write LaTeX formatted strings into separate .tex files
+# Function to split LaTeX formatted strings into standalone .tex documents
 # Input:
-#   strings (str): The LaTeX formatted string to write
-#   group_size (int, optional): Number of characters per file.
-#   folder_name (str, optional): Name of the folder to save .tex files.
+#   strings (str): The LaTeX formatted string to split
+#   group_size (int): Number of characters per document
 # Output:
-#   None (writes multiple .tex files into the specified folder)
-def write_strings_to_files(strings, group_size, folder_name):
-    os.makedirs(folder_name, exist_ok=True)
+#   documents (generator): Complete .tex documents with a randomized preamble
+def build_tex_documents(strings, group_size):
     num_files = (len(strings) + group_size - 1) // group_size
-    
+
     for i in range(num_files):
-        file_name = f"{folder_name}/{i + 1}.tex"
         start_index = i * group_size
         end_index = start_index + group_size
         current_group = strings[start_index:end_index]
@@ -147,25 +220,51 @@ def write_strings_to_files(strings, group_size, folder_name):
         bg += '\\usepackage{amssymb}\n\\usepackage{amsmath}\n\\usepackage{stmaryrd}\n\\usepackage{color}\n'
         bg += '\\nonstopmode\n\\pagestyle{empty}\n\\renewcommand{\\baselinestretch}{' + str(line) + '}\n\n\\begin{document}\n \\newpage'
         ed = '\\end{document}'
+        yield bg + ''.join(current_group) + ed
+
+# Function to write LaTeX formatted strings into separate .tex files
+# Input:
+#   strings (str): The LaTeX formatted string to write
+#   group_size (int, optional): Number of characters per file.
+#   folder_name (str, optional): Name of the folder to save .tex files.
+# Output:
+#   None (writes multiple .tex files into the specified folder)
+def write_strings_to_files(strings, group_size, folder_name):
+    os.makedirs(folder_name, exist_ok=True)
+
+    for i, document in enumerate(build_tex_documents(strings, group_size)):
+        file_name = f"{folder_name}/{i + 1}.tex"
         with open(file_name, 'w', encoding='utf-8') as file:
-            file.write(bg)
-            file.write(''.join(current_group))
-            file.write(ed)
+            file.write(document)
+
+# Function to write LaTeX formatted strings into one packed shard
+# Input:
+#   strings (str): The LaTeX formatted string to write
+#   group_size (int): Number of characters per document
+#   shard_path (str): Path of the .mxshard file to create
+# Output:
+#   None (writes one record per document, meta holds the document number)
+def write_strings_to_shard(strings, group_size, shard_path):
+    with ShardWriter(shard_path) as writer:
+        for i, document in enumerate(build_tex_documents(strings, group_size)):
+            writer.add(document, meta={'name': f'{i + 1}.tex'})
 
 # Main function to connect all steps
 # Input:
 #   input_text_file (str): Path to the input text file
 #   input_tex_file (str): Path to the input LaTeX (.tex) file containing formulas
 #   output_folder (str): Folder name to save the output .tex files
+#   group_size (int, optional): Number of characters per document
+#   shard_path (str, optional): Write all documents into this .mxshard file instead of output_folder
 # Output:
 #   None (executes the entire processing pipeline and writes output files)
-def main(input_text_file, input_tex_file, output_folder):
+def main(input_text_file, input_tex_file, output_folder, group_size=2000, shard_path=None):
     # Step 1: Clean the input text file by removing non-English characters
     cleaned_text_file = 'en_only.txt'
     remove_non_english_characters(input_text_file, cleaned_text_file)
 
-    # Step 2: Extract LaTeX formulas from the input LaTeX file
-    formulas = extract_latex_formulas(input_tex_file)
+    # Step 2: Extract LaTeX formulas from the input LaTeX file (cached next to it)
+    formulas = extract_latex_formulas(input_tex_file, os.path.splitext(input_tex_file)[0] + '.bank.json.gz')
 
     # Step 3: Process the cleaned text and insert LaTeX formulas randomly
     processed_text_file = 'en_line.txt'
@@ -180,9 +279,23 @@ def main(input_text_file, input_tex_file, output_folder):
     words = jieba.lcut(txt_content)
     latex_content = format_text_with_latex(words, formulas, lines)
 
-    # Step 5: Write the formatted LaTeX strings into .tex files in the specified folder
-    write_strings_to_files(latex_content, folder_name=output_folder)
+    # Step 5: Write the formatted LaTeX strings into .tex files in the specified folder (or one shard)
+    if shard_path:
+        write_strings_to_shard(latex_content, group_size, shard_path)
+    else:
+        write_strings_to_files(latex_content, group_size, output_folder)
 
-# Example usage
+# Example usage:
+#   python gen.py                          writes en/1.tex, en/2.tex, ...
+#   python gen.py --shard en.mxshard       packs the same documents into one shard
 if __name__ == "__main__":
-    main('endata1.txt', 'formular.tex', 'en')
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate mixed text/formula LaTeX documents')
+    parser.add_argument('--text', default='endata1.txt', help='input text file')
+    parser.add_argument('--formulas', default='formular.tex', help='LaTeX file to take formulas from')
+    parser.add_argument('--output', default='en', help='folder for the .tex files')
+    parser.add_argument('--group-size', type=int, default=2000, help='characters per document')
+    parser.add_argument('--shard', help='write one .mxshard file instead of a folder of .tex files')
+    args = parser.parse_args()
+    main(args.text, args.formulas, args.output, args.group_size, args.shard)
@@ -1,19 +1,17 @@
 from mixtex_core import (
-    load_model,
+    InferenceClient,
+    LatexPostprocessor,
     pad_image,
-    stream_inference,
-    # convert_align_to_equations,
 )
 from PIL import Image
 
 if __name__ == "__main__":
-    model = load_model("onnx")
+    # Uses a running mixtex_daemon if there is one, else loads the model here
+    client = InferenceClient("onnx")
     img = Image.open("test.png").convert("RGB")
     img_padded = pad_image(img)
-    partial_result = []
-    for piece in stream_inference(img_padded, model):
-        print(piece, end="", flush=True)  # 流式输出
-        partial_result.append(piece)
-
-    # result_text = convert_align_to_equations("".join(partial_result))
-    # print("\n最终结果:\n", result_text)
+    # align_to_equations=True 输出每行一个 $$ ... $$ 公式
+    postprocessor = LatexPostprocessor(inline_dollars=False, align_to_equations=False)
+    for piece in client.stream(img_padded):
+        print(postprocessor.feed(piece), end="", flush=True)  # 流式输出（已后处理）
+    print(postprocessor.finish())
@@ -1,14 +1,17 @@
 from mixtex_core import (
-    load_model,
+    InferenceClient,
+    LatexPostprocessor,
     pad_image,
-    stream_inference,
-    # convert_align_to_equations,
 )
 from PIL import Image
+import time
 
 import streamlit as st
 from PIL import ImageGrab
 
+# Minimum seconds between redraws of the streamed LaTeX output
+RENDER_INTERVAL = 0.1
+
 
 def main():
     st.set_page_config(page_title="MixTeX LaTeX OCR", page_icon="../icon.ico")
@@ -16,7 +19,9 @@ def main():
     import os
     # Get the absolute path to the onnx folder
     onnx_path = os.path.join(os.path.dirname(__file__), "..", "onnx")
-    model = load_model(onnx_path)
+    # Uses a running mixtex_daemon if there is one; otherwise the in-process
+    # model is cached across Streamlit reruns and loads once per process
+    client = InferenceClient(onnx_path)
 
     uploaded_file = st.file_uploader("Choose image file", type=["png", "jpg", "jpeg"])
 
@@ -25,7 +30,7 @@ def main():
             img = ImageGrab.grabclipboard()
             if img:
                 st.image(img, caption="Clipboard image preview")
-                run_inference(model, img)
+                run_inference(client, img)
             else:
                 st.warning("No image available in clipboard")
         except Exception as e:
@@ -34,16 +39,23 @@ def main():
     if uploaded_file:
         img = Image.open(uploaded_file).convert("RGB")
         st.image(img, caption="Uploaded image preview")
-        run_inference(model, img)
+        run_inference(client, img)
 
 
-def run_inference(model, img):
+def run_inference(client, img):
     img_padded = pad_image(img)
-    partial_result = ""
+    postprocessor = LatexPostprocessor()
+    pieces = []
     output_area = st.empty()
-    for piece in stream_inference(img_padded, model):
-        partial_result += piece
-        output_area.code(partial_result, language="latex")
+    last_render = 0.0
+    for piece in client.stream(img_padded):
+        pieces.append(postprocessor.feed(piece))
+        now = time.perf_counter()
+        if now - last_render >= RENDER_INTERVAL:
+            output_area.code("".join(pieces), language="latex")
+            last_render = now
+    pieces.append(postprocessor.finish())
+    output_area.code("".join(pieces), language="latex")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+"""
+Batch OCR of image directories, resumable.
+
+    python mixtex_batch.py scans/ --output scans.jsonl
+    python mixtex_batch.py --list crops.txt --output crops.jsonl --processes 4
+
+Walks the given directories (and/or reads paths from --list, one per line,
+"-" for stdin), runs every image through OCRPipeline and appends one JSON
+line per image to --output as results come in:
+
+    {"path": "scans/a.png", "text": "...", "tokens": 41, "stop_reason": "eos", ...}
+    {"path": "scans/b.png", "error": "UnidentifiedImageError: ..."}
+
+The output file is also the checkpoint: a rerun with the same --output skips
+every path already in it (failed ones too, unless --retry-errors), so an
+interrupted job resumes where it stopped. Paths are matched as written, so
+resume from the same working directory. Lines are in completion order, not
+input order.
+
+--processes N runs N model replicas in worker processes, each with its own
+pipeline (--batch-size images per encoder run, --decoder-workers concurrent
+decodes); intra-op threads come from mixtex_tune.py's settings for that
+many replicas, or are split between them, unless given explicitly.
+With --shared-weights the replicas share one copy of the weights (see
+mixtex_share_weights.py). Progress, throughput and ETA go to stderr.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from PIL import Image
+
+from mixtex_core import load_model, pad_image, trim_whitespace, warmup
+from mixtex_pipeline import OCRPipeline
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+
+
+def find_images(paths, list_file=None):
+    """Image paths under the given files/directories plus those listed in list_file, deduplicated."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_SUFFIXES)]
+        else:
+            found.append(path)
+    if list_file:
+        f = sys.stdin if list_file == "-" else open(list_file, encoding="utf-8")
+        with f:
+            found += [line.strip() for line in f if line.strip()]
+    return list(dict.fromkeys(found))
+
+
+def read_checkpoint(output_path, retry_errors=False):
+    """
+    Paths already recorded in output_path. A trailing partial line (the run
+    was killed mid-write) is cut off so that appending continues cleanly;
+    with retry_errors, failed paths are not counted as done.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    good_end = 0
+    with open(output_path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good_end += len(line)
+            if retry_errors and "error" in record:
+                continue
+            done.add(record["path"])
+        f.truncate(good_end)
+    return done
+
+
+class Blank(ValueError):
+    """The image has no ink (with --trim); recorded with empty text."""
+
+
+def make_loader(trim):
+    def load(path):
+        image = Image.open(path)
+        if trim:
+            image = trim_whitespace(image)
+            if image is None:
+                raise Blank()
+        return pad_image(image.convert("RGB"))
+
+    return load
+
+
+def record(result):
+    if isinstance(result.error, Blank):
+        return {"path": result.item, "text": "", "blank": True}
+    if result.error is not None:
+        return {"path": result.item, "error": f"{type(result.error).__name__}: {result.error}"}
+    return {"path": result.item, "text": result.text, **result.info}
+
+
+def build_pipeline(config):
+    model = load_model(
+        config["model_dir"],
+        encoder_threads=config["encoder_threads"],
+        decoder_threads=config["decoder_threads"],
+        shared_weights=config["shared_weights"],
+        replicas=config["replicas"],
+    )
+    warmup(model, batch_sizes=sorted({1, config["batch_size"]}))
+    return OCRPipeline(
+        model,
+        preprocess_workers=config["preprocess_workers"],
+        encoder_batch_size=config["batch_size"],
+        decoder_workers=config["decoder_workers"],
+        loader=make_loader(config["trim"]),
+        max_tokens=config["max_tokens"],
+    )
+
+
+def _drain(tasks):
+    while True:
+        path = tasks.get()
+        if path is None:
+            return
+        yield path
+
+
+def _worker(config, tasks, results):
+    # The parent handles Ctrl-C and terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        pipeline = build_pipeline(config)
+        for result in pipeline.map(_drain(tasks)):
+            results.put(record(result))
+    except Exception as e:
+        results.put({"worker_error": f"{type(e).__name__}: {e}"})
+    results.put(None)
+
+
+def run_in_process(paths, config):
+    pipeline = build_pipeline(config)
+    for result in pipeline.map(paths):
+        yield record(result)
+
+
+def run_in_workers(paths, config, processes):
+    """Records from `processes` worker processes, pulling paths from one shared queue."""
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue(maxsize=256)
+    for path in paths:
+        tasks.put(path)
+    for _ in range(processes):
+        tasks.put(None)
+    workers = [context.Process(target=_worker, args=(config, tasks, results), daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        running = processes
+        while running:
+            try:
+                item = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("all worker processes exited unexpectedly")
+                continue
+            if item is None:
+                running -= 1
+            elif "worker_error" in item:
+                raise RuntimeError(f"worker failed: {item['worker_error']}")
+            else:
+                yield item
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    def __init__(self, total, skipped, interval):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        # Rates are measured from the first result so model loading does not skew the ETA
+        self.first_result = None
+
+    def update(self, rec):
+        self.done += 1
+        if self.first_result is None:
+            self.first_result = time.perf_counter()
+        self.errors += "error" in rec
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        measured = now - self.first_result if self.first_result else 0.0
+        rate = (self.done - 1) / measured if measured else 0.0
+        line = f"{self.skipped + self.done}/{self.skipped + self.total} images ({self.errors} errors), {rate:.2f} img/s"
+        if final:
+            line += f", {format_duration(elapsed)} elapsed"
+        elif rate:
+            line += f", ETA {format_duration((self.total - self.done) / rate)}"
+        print(line, file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR image directories to JSONL, resumably")
+    parser.add_argument("inputs", nargs="*", help="image files or directories (searched recursively)")
+    parser.add_argument("--list", help="file with one image path per line ('-' for stdin)")
+    parser.add_argument("--output", "-o", required=True, help="JSONL results, also the resume checkpoint")
+    parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--processes", type=int, default=1, help="model replicas in worker processes")
+    parser.add_argument("--batch-size", type=int, default=4, help="images per encoder run")
+    parser.add_argument("--decoder-workers", type=int, default=2, help="concurrent decodes per replica")
+    parser.add_argument("--preprocess-workers", type=int, default=2, help="image loading threads per replica")
+    parser.add_argument(
+        "--encoder-threads", type=int, help="intra-op threads (default: tuned by mixtex_tune.py, or CPUs / processes)"
+    )
+    parser.add_argument(
+        "--decoder-threads", type=int, help="intra-op threads (default: tuned by mixtex_tune.py, or CPUs / processes)"
+    )
+    parser.add_argument("--max-tokens", help="decode length cap: an int or 'auto'")
+    parser.add_argument("--trim", action="store_true", help="crop to ink before padding, skip blank images")
+    parser.add_argument(
+        "--shared-weights", action="store_true", help="memory-map *.shared.onnx (see mixtex_share_weights.py)"
+    )
+    parser.add_argument("--retry-errors", action="store_true", help="redo paths recorded with an error")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    paths = find_images(args.inputs, args.list)
+    if not paths:
+        sys.exit("No images found (pass directories, files or --list)")
+    done = read_checkpoint(args.output, args.retry_errors)
+    pending = [path for path in paths if path not in done]
+    print(f"{len(paths)} images, {len(paths) - len(pending)} already in {args.output}", file=sys.stderr)
+    if not pending:
+        return
+
+    processes = max(1, min(args.processes, len(pending)))
+    max_tokens = args.max_tokens
+    if max_tokens not in (None, "auto"):
+        max_tokens = int(max_tokens)
+    config = {
+        "model_dir": os.path.abspath(args.model_dir),
+        "encoder_threads": args.encoder_threads,
+        "decoder_threads": args.decoder_threads,
+        "shared_weights": args.shared_weights,
+        "replicas": processes,
+        "batch_size": args.batch_size,
+        "decoder_workers": args.decoder_workers,
+        "preprocess_workers": args.preprocess_workers,
+        "trim": args.trim,
+        "max_tokens": max_tokens,
+    }
+    records = run_in_process(pending, config) if processes == 1 else run_in_workers(pending, config, processes)
+
+    progress = Progress(len(pending), len(paths) - len(pending), args.progress_interval)
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            for rec in records:
+                # One flushed line per image: a kill loses at most the line being written
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+                progress.update(rec)
+    except KeyboardInterrupt:
+        progress.report(final=True)
+        sys.exit(f"Interrupted; rerun the same command to resume from {args.output}")
+    progress.report(final=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,133 @@
 import onnxruntime as ort
 import numpy as np
 from PIL import Image
+import json
+import os
 import re
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+import warnings
 from transformers import AutoTokenizer, AutoImageProcessor
 
+from mixtex_trace import NULL_TRACER
 
-def load_model(model_dir):
+
+# Models re-saved by mixtex_share_weights.py, weights in page-aligned external files
+SHARED_SUFFIX = ".shared.onnx"
+
+# Decoder exported by mixtex_greedy_head.py: its first output is the argmax
+# token id of the last position instead of the full logits
+GREEDY_DECODER = "decoder_model_greedy"
+GREEDY_OUTPUT = "next_token"
+
+
+def session_options(intra_op_threads=None, shared_weights=False, execution_mode=None):
+    opts = ort.SessionOptions()
+    if intra_op_threads:
+        opts.intra_op_num_threads = intra_op_threads
+    if execution_mode == "parallel":
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    if shared_weights:
+        # Prepacking copies weights into private buffers; without it ORT runs
+        # on the read-only file mapping, shared through the page cache
+        opts.add_session_config_entry("session.disable_prepacking", "1")
+    return opts
+
+
+def model_path(model_dir, name, shared_weights=False):
+    """Path of encoder_model / decoder_model_merged, or of its shared-weights copy."""
+    if not shared_weights:
+        return os.path.join(model_dir, f"{name}.onnx")
+    path = os.path.join(model_dir, name + SHARED_SUFFIX)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} not found; create it with: python mixtex_share_weights.py --model-dir {model_dir}"
+        )
+    return path
+
+
+def decoder_name(model_dir, shared_weights=False, greedy_head=True):
+    """decoder_model_greedy when it has been exported (and is wanted), else decoder_model_merged."""
+    suffix = SHARED_SUFFIX if shared_weights else ".onnx"
+    if greedy_head and os.path.exists(os.path.join(model_dir, GREEDY_DECODER + suffix)):
+        return GREEDY_DECODER
+    return "decoder_model_merged"
+
+
+def thread_settings(encoder_path, decoder_path, encoder_threads=None, decoder_threads=None, replicas=1):
+    """Session settings for both models: explicit thread counts, else the
+    ones stored by mixtex_tune.py for this host, else ORT's defaults (split
+    between replicas)."""
+    # Imported here: mixtex_tune imports this module
+    from mixtex_tune import lookup, usable_cpus
+
+    tuned = None
+    if encoder_threads is None or decoder_threads is None:
+        tuned = lookup(encoder_path, decoder_path, replicas)
+    default = {"intra_op_threads": max(1, usable_cpus() // replicas) if replicas > 1 else None}
+    encoder = {"intra_op_threads": encoder_threads} if encoder_threads else (tuned or {}).get("encoder", default)
+    decoder = {"intra_op_threads": decoder_threads} if decoder_threads else (tuned or {}).get("decoder", default)
+    return encoder, decoder
+
+
+def load_model(
+    model_dir,
+    encoder_threads=None,
+    decoder_threads=None,
+    shared_weights=False,
+    greedy_head=True,
+    replicas=1,
+):
+    """Load the tokenizer, image processor and ONNX sessions.
+
+    With shared_weights, the sessions memory-map the weight files written by
+    mixtex_share_weights.py, so processes loading the same model share one
+    copy of the weights in the OS page cache instead of one each.
+    The greedy-head decoder from mixtex_greedy_head.py is used when present
+    unless greedy_head is False. Thread counts not given explicitly come
+    from mixtex_tune.py's stored settings for this host and number of
+    replicas sharing it, when it has been run.
+    """
     tokenizer = AutoTokenizer.from_pretrained(model_dir)
     feature_extractor = AutoImageProcessor.from_pretrained(model_dir)
-    encoder_sess = ort.InferenceSession(f"{model_dir}/encoder_model.onnx")
-    decoder_sess = ort.InferenceSession(f"{model_dir}/decoder_model_merged.onnx")
+    encoder_path = model_path(model_dir, "encoder_model", shared_weights)
+    decoder_path = model_path(model_dir, decoder_name(model_dir, shared_weights, greedy_head), shared_weights)
+    encoder_settings, decoder_settings = thread_settings(
+        encoder_path, decoder_path, encoder_threads, decoder_threads, replicas
+    )
+    encoder_sess = ort.InferenceSession(
+        encoder_path, session_options(shared_weights=shared_weights, **encoder_settings)
+    )
+    decoder_sess = ort.InferenceSession(
+        decoder_path, session_options(shared_weights=shared_weights, **decoder_settings)
+    )
     return tokenizer, feature_extractor, encoder_sess, decoder_sess
 
 
+_model_registry = {}
+_model_registry_lock = threading.Lock()
+
+
+def get_model(model_dir, **options):
+    """Process-wide cached load_model().
+
+    Front ends that re-run their script (Streamlit) or create several
+    clients share one tokenizer and one pair of ONNX sessions per model
+    directory and options.
+    """
+    key = (os.path.abspath(model_dir), tuple(sorted(options.items())))
+    with _model_registry_lock:
+        model = _model_registry.get(key)
+        if model is None:
+            model = load_model(key[0], **options)
+            _model_registry[key] = model
+        return model
+
+
 def pad_image(img, out_size=(448, 448)):
     x_img, y_img = out_size
     bg = Image.new("RGB", (x_img, y_img), (255, 255, 255))
@@ -31,6 +146,69 @@ def pad_image(img, out_size=(448, 448)):
     return bg
 
 
+INK_THRESHOLD = 200  # grayscale values below this count as ink
+
+
+def ink_mask(img, threshold=INK_THRESHOLD):
+    return np.asarray(img.convert("L")) < threshold
+
+
+def trim_whitespace(img, margin=8, min_ink_pixels=16, min_ink_fraction=2e-5):
+    """Crop an image to its ink bounding box plus margin.
+
+    Returns None for blank or near-blank images (fewer than min_ink_pixels
+    ink pixels, or less than min_ink_fraction of the area), so callers can
+    skip the model entirely.
+    """
+    if img.mode in ("RGBA", "LA", "P"):
+        # Transparent pixels would read as black ink; flatten onto white
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    mask = ink_mask(img)
+    ink = int(np.count_nonzero(mask))
+    if ink < min_ink_pixels or ink < min_ink_fraction * mask.size:
+        return None
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    box = (
+        max(int(cols[0]) - margin, 0),
+        max(int(rows[0]) - margin, 0),
+        min(int(cols[-1]) + 1 + margin, img.width),
+        min(int(rows[-1]) + 1 + margin, img.height),
+    )
+    return img.crop(box)
+
+
+def estimate_token_budget(
+    img, max_length=512, base=48, min_tokens=64, per_glyph=2, max_ink_fraction=0.35
+):
+    """Generous decode-length cap estimated from the ink in a padded image.
+
+    Counts glyphs without segmenting lines: each glyph adds about as many
+    ink-row transitions (left edges of strokes) as its height, and about
+    height x stroke width of ink area, so transitions**2 / area tracks the
+    glyph count whatever the font size or line pitch. Each glyph is budgeted
+    per_glyph tokens for multi-token LaTeX commands. Images where ink covers
+    more than max_ink_fraction of its bounding box (dark backgrounds, photos,
+    screenshots) get the full max_length.
+    """
+    mask = ink_mask(img)
+    area = int(np.count_nonzero(mask))
+    if area == 0:
+        return min_tokens
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    box = (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1)
+    if area > max_ink_fraction * box:
+        return max_length
+    transitions = np.count_nonzero(mask[:, 1:] & ~mask[:, :-1])
+    transitions += np.count_nonzero(mask[:, 0])
+    glyphs = transitions * transitions / area / 4
+    budget = base + per_glyph * glyphs
+    return int(min(max(budget, min_tokens), max_length))
+
+
 def check_repetition(s, repeats=12):
     for pattern_length in range(1, len(s) // repeats + 1):
         for start in range(len(s) - repeats * pattern_length + 1):
@@ -40,21 +218,130 @@ def check_repetition(s, repeats=12):
     return False
 
 
-def convert_align_to_equations(text):
-    text = re.sub(r"\\begin\{align\*\}|\\end\{align\*\}", "", text).replace("&", "")
-    eqs = text.strip().split("\\\\")
-    return "\n".join(f"$$ {eq.strip()} $$" for eq in eqs if eq.strip())
+# Output rewriting: literal pattern -> replacement (None ends an equation).
+# No pattern is a prefix of another, so whether a match starts at a position
+# depends only on the characters it covers; that is what lets
+# LatexPostprocessor rewrite a token stream without seeing the whole text.
+LATEX_RULES = {"\\[": "\\begin{align*}", "\\]": "\\end{align*}", "%": "\\%"}
+INLINE_DOLLAR_RULES = {"\\(": "$", "\\)": "$"}
+# align_to_equations: environment markers, alignment points and newlines are
+# dropped and every "\\" line break starts a new $$ ... $$ equation
+ALIGN_RULES = {
+    "\\begin{align*}": "",
+    "\\end{align*}": "",
+    "\\[": "",
+    "\\]": "",
+    "&": "",
+    "\n": "",
+    "\\\\": None,
+    "%": "\\%",
+}
 
 
-def stream_inference(
-    image, model, max_length=512, num_layers=6, hidden_size=768, heads=12, batch_size=1
-):
-    tokenizer, feature_extractor, enc_session, dec_session = model
-    head_size = hidden_size // heads
-    inputs = feature_extractor(image, return_tensors="np").pixel_values
-    enc_out = enc_session.run(None, {"pixel_values": inputs})[0]
-    dec_in = {
-        "input_ids": tokenizer("<s>", return_tensors="np").input_ids.astype(np.int64),
+def _compile_rules(inline_dollars, align_to_equations):
+    rules = dict(ALIGN_RULES if align_to_equations else LATEX_RULES)
+    if inline_dollars:
+        rules.update(INLINE_DOLLAR_RULES)
+    pattern = re.compile("|".join(map(re.escape, rules)))
+    prefixes = {p[:n] for p in rules for n in range(1, len(p))}
+    return pattern, rules, prefixes, max(map(len, prefixes), default=0)
+
+
+_LATEX_RULESETS = {(d, a): _compile_rules(d, a) for d in (False, True) for a in (False, True)}
+
+
+class LatexPostprocessor:
+    """
+    The front ends' output rewriting in one pass over the text, applied
+    incrementally as tokens arrive:
+
+        \\[ \\]  -> \\begin{align*} \\end{align*},  % -> \\%
+        inline_dollars:      \\( \\) -> $
+        align_to_equations:  every line (split at \\\\, without align* markers,
+                             &, \\[ \\] and newlines) becomes "$$ line $$"
+
+    and leading/trailing whitespace is stripped. feed(delta) returns the
+    output that is final so far; a tail that could still begin a pattern and
+    trailing whitespace are held back until the next delta or finish(). The
+    joined output is the same however the input was split, so it equals
+    postprocess_latex() of the whole text.
+    """
+
+    def __init__(self, inline_dollars=False, align_to_equations=False):
+        self.align_to_equations = align_to_equations
+        self._pattern, self._rules, self._prefixes, self._max_prefix = _LATEX_RULESETS[
+            (bool(inline_dollars), bool(align_to_equations))
+        ]
+        self._pending = ""  # input that may be the start of a pattern
+        self._space = ""  # output whitespace, emitted only if more text follows
+        self._open = False  # past the leading whitespace (of the current equation)
+        self._equations = 0
+
+    def feed(self, text):
+        buf = self._pending + text
+        hold = next(
+            (n for n in range(min(self._max_prefix, len(buf)), 0, -1) if buf[-n:] in self._prefixes), 0
+        )
+        out = []
+        end = self._scan(buf, len(buf) - hold, out)
+        self._pending = buf[end:]
+        return "".join(out)
+
+    def finish(self):
+        """The rest of the output; the processor is ready for a new text afterwards."""
+        out = []
+        self._scan(self._pending, len(self._pending), out)
+        if self.align_to_equations and self._open:
+            out.append(" $$")
+        self._pending, self._space, self._open, self._equations = "", "", False, 0
+        return "".join(out)
+
+    def _scan(self, buf, cut, out):
+        # Matches starting before cut are complete and final (one may extend past it)
+        pos = 0
+        for m in self._pattern.finditer(buf):
+            if m.start() >= cut:
+                break
+            self._emit(buf[pos : m.start()], out)
+            replacement = self._rules[m.group()]
+            if replacement is None:
+                if self._open:
+                    out.append(" $$")
+                self._space, self._open = "", False
+            else:
+                self._emit(replacement, out)
+            pos = m.end()
+        end = max(pos, cut)
+        self._emit(buf[pos:end], out)
+        return end
+
+    def _emit(self, text, out):
+        if not self._open:
+            text = text.lstrip()
+            if not text:
+                return
+            if self.align_to_equations:
+                out.append("\n$$ " if self._equations else "$$ ")
+                self._equations += 1
+            self._open = True
+        body = text.rstrip()
+        if body:
+            out.append(self._space + body)
+            self._space = text[len(body) :]
+        else:
+            self._space += text
+
+
+def postprocess_latex(text, inline_dollars=False, align_to_equations=False):
+    post = LatexPostprocessor(inline_dollars, align_to_equations)
+    return post.feed(text) + post.finish()
+
+
+def init_decoder_inputs(tokenizer, enc_out, num_layers=6, heads=12, head_size=64):
+    batch_size = enc_out.shape[0]
+    bos = tokenizer("<s>", return_tensors="np").input_ids.astype(np.int64)
+    return {
+        "input_ids": np.repeat(bos, batch_size, axis=0),
         "encoder_hidden_states": enc_out,
         "use_cache_branch": np.array([True], dtype=bool),
         **{
@@ -65,22 +352,342 @@ def stream_inference(
             for t in ["key", "value"]
         },
     }
+
+
+def advance_decoder_inputs(dec_in, next_id, outs, num_layers=6):
+    dec_in.update(
+        {
+            "input_ids": next_id[:, None],
+            **{
+                f"past_key_values.{i}.{t}": outs[i * 2 + 1 + j]
+                for i in range(num_layers)
+                for j, t in enumerate(["key", "value"])
+            },
+        }
+    )
+
+
+def kv_cache_bytes(dec_in):
+    """Bytes held by the past_key_values arrays fed to the next decoder step."""
+    return sum(v.nbytes for k, v in dec_in.items() if k.startswith("past_key_values."))
+
+
+def is_greedy_decoder(dec_session):
+    return dec_session.get_outputs()[0].name == GREEDY_OUTPUT
+
+
+def next_token_ids(outs, greedy):
+    """Greedy token ids (batch,) from a decoder run: in-graph for greedy-head decoders."""
+    if greedy:
+        return outs[0][:, -1]
+    return np.argmax(outs[0][:, -1, :], axis=-1)
+
+
+def encode(images, model, tracer=NULL_TRACER):
+    """Run the encoder on one image or a list of padded images as one batch."""
+    _, feature_extractor, enc_session, _ = model
+    with tracer.span("feature_extraction"):
+        inputs = feature_extractor(images, return_tensors="np").pixel_values
+    with tracer.span("encoder", batch=len(inputs)):
+        return enc_session.run(None, {"pixel_values": inputs})[0]
+
+
+def decode_stream(
+    enc_out,
+    model,
+    max_length=512,
+    num_layers=6,
+    hidden_size=768,
+    heads=12,
+    deadline=None,
+    max_tokens=None,
+    info=None,
+    tracer=NULL_TRACER,
+):
+    """Yield decoded tokens for one encoder output of shape (1, seq, hidden).
+
+    deadline is an absolute time.perf_counter() value; deadline and
+    max_tokens are checked between decoder steps. If info is a dict it
+    receives the token count, the stop_reason ("eos", "repetition",
+    "max_length", "max_tokens" or "deadline") and a truncated flag.
+    """
+    limit, limit_reason = max_length, "max_length"
+    if max_tokens is not None and max_tokens < max_length:
+        limit, limit_reason = max_tokens, "max_tokens"
+    tokenizer, _, _, dec_session = model
+    head_size = hidden_size // heads
+    dec_in = init_decoder_inputs(tokenizer, enc_out, num_layers, heads, head_size)
+    greedy = is_greedy_decoder(dec_session)
     generated = ""
-    for _ in range(max_length):
-        outs = dec_session.run(None, dec_in)
-        next_id = np.argmax(outs[0][:, -1, :], axis=-1)
-        token_text = tokenizer.decode(next_id, skip_special_tokens=True)
+    tokens = 0
+    stop_reason = limit_reason
+    while tokens < limit:
+        if deadline is not None and time.perf_counter() >= deadline:
+            stop_reason = "deadline"
+            break
+        span_args = {"step": tokens}
+        if tracer.enabled:
+            span_args["kv_bytes"] = kv_cache_bytes(dec_in)
+        with tracer.span("decoder", **span_args):
+            outs = dec_session.run(None, dec_in)
+            next_id = next_token_ids(outs, greedy)
+        with tracer.span("detokenize"):
+            token_text = tokenizer.decode(next_id, skip_special_tokens=True)
+        tokens += 1
         yield token_text  # 流式输出
         generated += token_text
-        if check_repetition(generated, 21) or next_id == tokenizer.eos_token_id:
+        if next_id == tokenizer.eos_token_id:
+            stop_reason = "eos"
+            break
+        with tracer.span("repetition_check"):
+            repeated = check_repetition(generated, 21)
+        if repeated:
+            stop_reason = "repetition"
             break
-        dec_in.update(
-            {
-                "input_ids": next_id[:, None],
-                **{
-                    f"past_key_values.{i}.{t}": outs[i * 2 + 1 + j]
-                    for i in range(num_layers)
-                    for j, t in enumerate(["key", "value"])
-                },
-            }
+        advance_decoder_inputs(dec_in, next_id, outs, num_layers)
+    if info is not None:
+        info.update(
+            tokens=tokens,
+            stop_reason=stop_reason,
+            truncated=stop_reason in ("max_length", "max_tokens", "deadline"),
         )
+
+
+def stream_inference(
+    image,
+    model,
+    max_length=512,
+    num_layers=6,
+    hidden_size=768,
+    heads=12,
+    batch_size=1,
+    deadline_ms=None,
+    max_tokens=None,
+    info=None,
+    tracer=NULL_TRACER,
+):
+    """Yield decoded tokens for one padded image.
+
+    deadline_ms is a wall-clock budget from the call, max_tokens an int or
+    "auto" for estimate_token_budget; see decode_stream for info.
+    """
+    started = time.perf_counter()
+    deadline = None if deadline_ms is None else started + deadline_ms / 1000
+    if max_tokens == "auto":
+        max_tokens = estimate_token_budget(image, max_length)
+    enc_out = encode(image, model, tracer)
+    yield from decode_stream(
+        enc_out,
+        model,
+        max_length,
+        num_layers,
+        hidden_size,
+        heads,
+        deadline=deadline,
+        max_tokens=max_tokens,
+        info=info,
+        tracer=tracer,
+    )
+    if info is not None:
+        info["seconds"] = round(time.perf_counter() - started, 4)
+
+
+def warmup(
+    model, batch_sizes=(1,), decode_steps=4, num_layers=6, hidden_size=768, heads=12
+):
+    """Run a blank 448x448 encode plus a few decoder steps per batch size.
+
+    ONNX Runtime allocates its arenas and picks kernels lazily on the first
+    runs for each input shape; doing that here keeps it off real requests.
+    """
+    tokenizer, feature_extractor, enc_session, dec_session = model
+    head_size = hidden_size // heads
+    blank = Image.new("RGB", (448, 448), (255, 255, 255))
+    pixel_values = feature_extractor(blank, return_tensors="np").pixel_values
+    greedy = is_greedy_decoder(dec_session)
+    for batch_size in batch_sizes:
+        batch = np.repeat(pixel_values, batch_size, axis=0)
+        enc_out = enc_session.run(None, {"pixel_values": batch})[0]
+        dec_in = init_decoder_inputs(tokenizer, enc_out, num_layers, heads, head_size)
+        for _ in range(decode_steps):
+            outs = dec_session.run(None, dec_in)
+            next_id = next_token_ids(outs, greedy)
+            advance_decoder_inputs(dec_in, next_id, outs, num_layers)
+
+
+# --- Local inference daemon (see mixtex_daemon.py) -------------------------
+#
+# Frames are a 1-byte type, a u32 little-endian payload length and the
+# payload. Client -> daemon: b"P" ping, b"R" request (u16 width, u16 height,
+# u32 options length, options JSON, raw RGB pixels). Daemon -> client:
+# b"O" pong (JSON), b"T" one decoded token (UTF-8), b"E" end of stream
+# (JSON), b"X" error (UTF-8 message).
+
+_FRAME_HEADER = struct.Struct("<cI")
+_REQUEST_HEADER = struct.Struct("<HHI")
+
+
+def default_daemon_socket():
+    """
+    MIXTEX_DAEMON_SOCKET, else mixtex.sock in $XDG_RUNTIME_DIR, else in a
+    per-user 0700 directory under the temp dir. A fixed name directly in
+    /tmp could be bound first by another local user.
+    """
+    if os.environ.get("MIXTEX_DAEMON_SOCKET"):
+        return os.environ["MIXTEX_DAEMON_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir or not os.path.isdir(runtime_dir):
+        uid = getattr(os, "getuid", lambda: "user")()
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"mixtex-{uid}")
+        try:
+            os.mkdir(runtime_dir, 0o700)
+        except FileExistsError:
+            pass  # checked by trusted_socket_dir before use
+    return os.path.join(runtime_dir, "mixtex.sock")
+
+
+def trusted_socket_dir(socket_path):
+    """
+    True if nobody but this user (or root) can put a socket at socket_path:
+    its directory is ours or root's, and not writable by others unless
+    sticky (like /tmp, where others cannot replace our files).
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        st = os.lstat(os.path.dirname(os.path.abspath(socket_path)))
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid not in (os.getuid(), 0):
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or bool(st.st_mode & stat.S_ISVTX)
+
+
+def daemon_is_ours(socket_path, sock=None):
+    """
+    True if the socket file at socket_path belongs to this user in a
+    trusted directory and, given the connected sock, the process serving it
+    runs as this user too (SO_PEERCRED, where available).
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    if not trusted_socket_dir(socket_path):
+        return False
+    try:
+        if os.lstat(socket_path).st_uid != os.getuid():
+            return False
+    except OSError:
+        return False
+    if sock is not None and hasattr(socket, "SO_PEERCRED"):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", creds)[1] == os.getuid()
+    return True
+
+
+def send_frame(sock, kind, payload=b""):
+    sock.sendall(_FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("MixTeX daemon closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    kind, size = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return kind, _recv_exact(sock, size) if size else b""
+
+
+def encode_request(image, options):
+    image = image.convert("RGB")
+    options_bytes = json.dumps(options).encode("utf-8")
+    return (
+        _REQUEST_HEADER.pack(image.width, image.height, len(options_bytes))
+        + options_bytes
+        + image.tobytes()
+    )
+
+
+def decode_request(payload):
+    width, height, options_len = _REQUEST_HEADER.unpack_from(payload)
+    start = _REQUEST_HEADER.size
+    options = json.loads(payload[start : start + options_len])
+    pixels = payload[start + options_len :]
+    return Image.frombytes("RGB", (width, height), pixels), options
+
+
+class InferenceClient:
+    """Stream OCR through the local daemon, or in-process when none is running.
+
+    The daemon is probed on every call, so a daemon started or stopped while
+    a front end runs is picked up. The in-process model is only loaded (via
+    get_model) the first time the daemon is unavailable, or up front with
+    preload=True.
+    """
+
+    def __init__(self, model_dir, socket_path=None, preload=False, connect_timeout=0.5):
+        self.model_dir = model_dir
+        self.socket_path = socket_path or default_daemon_socket()
+        self.connect_timeout = connect_timeout
+        if preload and not self.daemon_available():
+            get_model(model_dir)
+
+    def _connect(self):
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(self.socket_path):
+            return None
+        # Another user's socket would get our images and choose our output
+        if not daemon_is_ours(self.socket_path):
+            warnings.warn(f"Not using {self.socket_path}: not owned by the current user", RuntimeWarning)
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return None
+        if not daemon_is_ours(self.socket_path, sock):
+            sock.close()
+            warnings.warn(f"Not using {self.socket_path}: served by another user", RuntimeWarning)
+            return None
+        sock.settimeout(None)
+        return sock
+
+    def daemon_available(self):
+        sock = self._connect()
+        if sock is None:
+            return False
+        try:
+            send_frame(sock, b"P")
+            return recv_frame(sock)[0] == b"O"
+        except (OSError, ConnectionError):
+            return False
+        finally:
+            sock.close()
+
+    def stream(self, image, info=None, **options):
+        sock = self._connect()
+        if sock is None:
+            yield from stream_inference(image, get_model(self.model_dir), info=info, **options)
+            return
+        try:
+            send_frame(sock, b"R", encode_request(image, options))
+            while True:
+                kind, payload = recv_frame(sock)
+                if kind == b"T":
+                    yield payload.decode("utf-8")
+                elif kind == b"E":
+                    if info is not None:
+                        info.update(json.loads(payload))
+                    return
+                elif kind == b"X":
+                    raise RuntimeError(f"MixTeX daemon error: {payload.decode('utf-8')}")
+                else:
+                    raise ConnectionError(f"Unexpected frame from MixTeX daemon: {kind!r}")
+        finally:
+            sock.close()
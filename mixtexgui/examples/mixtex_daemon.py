@@ -0,0 +1,140 @@
+"""
+Local MixTeX inference daemon.
+
+Holds one warm model and serves OCR over a Unix domain socket, so the
+desktop app, the Streamlit app and the CLI examples share a single model
+per machine instead of each loading their own. Clients connect through
+mixtex_core.InferenceClient, which falls back to in-process inference when
+the daemon is not running.
+
+    python mixtex_daemon.py --model-dir ../onnx
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+
+from mixtex_core import (
+    decode_request,
+    default_daemon_socket,
+    load_model,
+    recv_frame,
+    send_frame,
+    stream_inference,
+    trusted_socket_dir,
+    warmup,
+)
+
+# stream_inference keyword arguments a client may set
+ALLOWED_OPTIONS = {"max_length", "deadline_ms", "max_tokens"}
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        while True:
+            try:
+                kind, payload = recv_frame(sock)
+            except (ConnectionError, OSError):
+                return
+            if kind == b"P":
+                info = {"model_dir": self.server.model_dir, "pid": os.getpid()}
+                send_frame(sock, b"O", json.dumps(info).encode("utf-8"))
+            elif kind == b"R":
+                if not self.serve_request(sock, payload):
+                    return
+            else:
+                send_frame(sock, b"X", f"Unknown frame type {kind!r}".encode("utf-8"))
+                return
+
+    def serve_request(self, sock, payload):
+        info = {}
+        try:
+            image, options = decode_request(payload)
+            options = {k: v for k, v in options.items() if k in ALLOWED_OPTIONS}
+            for token in stream_inference(image, self.server.model, info=info, **options):
+                send_frame(sock, b"T", token.encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream: stop decoding for it
+            return False
+        except Exception as e:
+            send_frame(sock, b"X", str(e).encode("utf-8"))
+            return True
+        send_frame(sock, b"E", json.dumps(info).encode("utf-8"))
+        return True
+
+
+class InferenceDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model_dir, model):
+        self.model_dir = model_dir
+        self.model = model
+        super().__init__(socket_path, InferenceHandler)
+
+
+def remove_stale_socket(socket_path):
+    """Remove a socket file left by a dead daemon; refuse if one is still serving."""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError(f"A MixTeX daemon is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve MixTeX OCR over a Unix domain socket")
+    parser.add_argument(
+        "--model-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+    )
+    parser.add_argument("--socket", default=default_daemon_socket())
+    parser.add_argument("--no-warmup", action="store_true")
+    parser.add_argument(
+        "--shared-weights", action="store_true", help="memory-map *.shared.onnx (see mixtex_share_weights.py)"
+    )
+    args = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("Unix domain sockets are not available on this platform")
+    if not trusted_socket_dir(args.socket):
+        sys.exit(f"The directory of {args.socket} is not private to this user; pick another --socket")
+
+    remove_stale_socket(args.socket)
+    model_dir = os.path.abspath(args.model_dir)
+    started = time.perf_counter()
+    model = load_model(model_dir, shared_weights=args.shared_weights)
+    if not args.no_warmup:
+        warmup(model)
+    print(f"Model loaded from {model_dir} in {time.perf_counter() - started:.2f}s")
+
+    old_umask = os.umask(0o077)  # socket is private to the current user
+    try:
+        server = InferenceDaemon(args.socket, model_dir, model)
+    finally:
+        os.umask(old_umask)
+    print(f"MixTeX daemon listening on {args.socket}")
+    # Exit through the finally block below so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Accuracy-versus-speed evaluation over labelled samples.
+
+Runs one or more inference configurations over the same labelled set and
+reports, per configuration, accuracy (normalized edit distance, exact
+match, BLEU over LaTeX tokens) next to latency and throughput. With two
+configurations the second is compared against the first, sample by sample,
+so a speedup that changes outputs is visible before it ships.
+
+Labelled sets:
+    --metadata data/metadata.csv   GUI feedback rows (default: marked Perfect)
+    --shard set.mxshard            shard records with an image (see mixtex_shard)
+
+Configurations are comma-separated key=value lists:
+    python mixtex_eval.py --metadata ../data/metadata.csv \\
+        --config name=baseline \\
+        --config name=auto-budget,max_tokens=auto,trim=1
+
+Keys: name, model_dir, shared_weights, encoder_threads, decoder_threads,
+max_length, max_tokens (int or auto), deadline_ms, trim (crop to ink before
+padding, as the backend does), pipeline (run through OCRPipeline),
+encoder_batch_size, decoder_workers. In pipeline mode stages overlap, so
+per-sample latency covers decoding only and deadline_ms is not applied;
+compare throughput there instead.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from PIL import Image
+
+from mixtex_core import get_model, pad_image, postprocess_latex, stream_inference, trim_whitespace, warmup
+from mixtex_pipeline import OCRPipeline
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+
+# LaTeX commands, escaped symbols, then single non-space characters
+_LATEX_TOKEN = re.compile(r"\\[a-zA-Z]+|\\.|\S")
+
+_INT_KEYS = {"encoder_threads", "decoder_threads", "max_length", "encoder_batch_size", "decoder_workers"}
+_BOOL_KEYS = {"shared_weights", "trim", "pipeline"}
+
+
+class Sample:
+    __slots__ = ("id", "image", "label")
+
+    def __init__(self, id, image, label):
+        self.id = id
+        self.image = image
+        self.label = label
+
+
+def load_metadata(metadata_path, feedback=("Perfect",)):
+    """GUI feedback rows whose feedback is in feedback, with their images."""
+    folder = os.path.dirname(os.path.abspath(metadata_path))
+    samples = []
+    with open(metadata_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            image_path = os.path.join(folder, row["file_name"])
+            if row["feedback"] in feedback and os.path.exists(image_path):
+                with Image.open(image_path) as image:
+                    samples.append(Sample(row["file_name"], image.convert("RGB"), row["text"]))
+    return samples
+
+
+def load_shard(shard_path, feedback=("Perfect",)):
+    """Shard records with an image. Records carrying a feedback tag must match feedback."""
+    from mixtex_shard import ShardReader
+
+    samples = []
+    with ShardReader(shard_path) as reader:
+        for index, record in enumerate(reader):
+            tag = (record.meta or {}).get("feedback")
+            if not record.image or (tag is not None and tag not in feedback):
+                continue
+            sample_id = f"{os.path.basename(shard_path)}:{index}"
+            samples.append(Sample(sample_id, record.open_image().convert("RGB"), record.text))
+    return samples
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def normalized_edit_distance(prediction, label):
+    """Character edit distance over the longer length: 0 is identical, 1 is nothing in common."""
+    prediction, label = normalize(prediction), normalize(label)
+    longest = max(len(prediction), len(label))
+    return edit_distance(prediction, label) / longest if longest else 0.0
+
+
+def tokenize(text):
+    return _LATEX_TOKEN.findall(text)
+
+
+def corpus_bleu(predictions, labels, max_n=4):
+    """Corpus BLEU over LaTeX tokens (one reference per sample), 0..100."""
+    matches = [0] * max_n
+    totals = [0] * max_n
+    pred_length = ref_length = 0
+    for prediction, label in zip(predictions, labels):
+        pred, ref = tokenize(prediction), tokenize(label)
+        pred_length += len(pred)
+        ref_length += len(ref)
+        for n in range(1, max_n + 1):
+            pred_ngrams = Counter(tuple(pred[i : i + n]) for i in range(len(pred) - n + 1))
+            ref_ngrams = Counter(tuple(ref[i : i + n]) for i in range(len(ref) - n + 1))
+            matches[n - 1] += sum((pred_ngrams & ref_ngrams).values())
+            totals[n - 1] += max(len(pred) - n + 1, 0)
+    if matches[0] == 0:
+        return 0.0
+    # Add-one smoothing for n > 1 keeps small sets from scoring exactly zero
+    log_precision = math.log(matches[0] / totals[0])
+    for n in range(1, max_n):
+        log_precision += math.log((matches[n] + 1) / (totals[n] + 1))
+    log_precision /= max_n
+    brevity = 1.0 if pred_length > ref_length else math.exp(1 - ref_length / pred_length)
+    return 100 * brevity * math.exp(log_precision)
+
+
+def parse_config(text):
+    config = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        key, _, value = item.partition("=")
+        if key in _INT_KEYS:
+            config[key] = int(value)
+        elif key in _BOOL_KEYS:
+            config[key] = value.lower() in ("1", "true", "yes")
+        elif key == "deadline_ms":
+            config[key] = float(value)
+        elif key == "max_tokens":
+            config[key] = value if value == "auto" else int(value)
+        elif key in ("name", "model_dir"):
+            config[key] = value
+        else:
+            raise argparse.ArgumentTypeError(f"unknown config key {key!r}")
+    config.setdefault("name", text or "default")
+    return config
+
+
+class BlankImage(ValueError):
+    """trim found no ink; the sample's output is empty, as in the backend."""
+
+
+def prepare(image, config):
+    """Image as the configured front end would hand it to the model."""
+    if config.get("trim"):
+        image = trim_whitespace(image)
+        if image is None:
+            raise BlankImage()
+    return pad_image(image)
+
+
+def run_config(samples, config):
+    """Run one configuration; returns (per-sample results, wall seconds)."""
+    model = get_model(
+        config.get("model_dir", DEFAULT_MODEL_DIR),
+        encoder_threads=config.get("encoder_threads"),
+        decoder_threads=config.get("decoder_threads"),
+        shared_weights=config.get("shared_weights", False),
+    )
+    warmup(model)
+    max_length = config.get("max_length", 512)
+    results = [None] * len(samples)
+    started = time.perf_counter()
+    if config.get("pipeline"):
+        pipeline = OCRPipeline(
+            model,
+            encoder_batch_size=config.get("encoder_batch_size", 4),
+            decoder_workers=config.get("decoder_workers", 2),
+            loader=lambda sample: prepare(sample.image, config),
+            max_length=max_length,
+            max_tokens=config.get("max_tokens"),
+        )
+        for result in pipeline.map(samples):
+            error = None if result.error is None or isinstance(result.error, BlankImage) else str(result.error)
+            results[result.index] = {
+                "text": result.text or "",
+                "seconds": result.info.get("seconds", 0.0),
+                "tokens": result.info.get("tokens", 0),
+                "error": error,
+            }
+    else:
+        for index, sample in enumerate(samples):
+            sample_started = time.perf_counter()
+            info = {}
+            text = ""
+            try:
+                image = prepare(sample.image, config)
+            except BlankImage:
+                image = None
+            if image is not None:
+                text = "".join(
+                    stream_inference(
+                        image,
+                        model,
+                        max_length=max_length,
+                        deadline_ms=config.get("deadline_ms"),
+                        max_tokens=config.get("max_tokens"),
+                        info=info,
+                    )
+                )
+            results[index] = {
+                "text": text,
+                "seconds": time.perf_counter() - sample_started,
+                "tokens": info.get("tokens", 0),
+                "error": None,
+            }
+    elapsed = time.perf_counter() - started
+    for sample, result in zip(samples, results):
+        # The GUI's output rewriting, which the feedback labels were saved after
+        result["text"] = postprocess_latex(result["text"])
+        result["ned"] = normalized_edit_distance(result["text"], sample.label)
+        result["exact"] = normalize(result["text"]) == normalize(sample.label)
+    return results, elapsed
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1] if ordered else None
+
+
+def summarize(samples, results, elapsed):
+    seconds = [r["seconds"] for r in results]
+    tokens = sum(r["tokens"] for r in results)
+    return {
+        "samples": len(samples),
+        "exact_match": sum(r["exact"] for r in results) / len(results),
+        "mean_ned": sum(r["ned"] for r in results) / len(results),
+        "bleu": corpus_bleu([r["text"] for r in results], [s.label for s in samples]),
+        "errors": sum(1 for r in results if r["error"]),
+        "p50_ms": 1000 * percentile(seconds, 50),
+        "p95_ms": 1000 * percentile(seconds, 95),
+        "samples_per_s": len(results) / elapsed if elapsed else 0.0,
+        "tokens_per_s": tokens / elapsed if elapsed else 0.0,
+        "wall_s": elapsed,
+    }
+
+
+METRICS = [
+    ("exact_match", "exact match", "{:.1%}"),
+    ("mean_ned", "mean norm. edit distance", "{:.4f}"),
+    ("bleu", "BLEU", "{:.2f}"),
+    ("errors", "errors", "{}"),
+    ("p50_ms", "p50 latency (ms)", "{:.0f}"),
+    ("p95_ms", "p95 latency (ms)", "{:.0f}"),
+    ("samples_per_s", "samples/s", "{:.2f}"),
+    ("tokens_per_s", "tokens/s", "{:.1f}"),
+]
+
+
+def print_report(configs, summaries):
+    width = max(14, *(len(c["name"]) for c in configs))
+    print(f"{'':<26}" + "".join(f"{c['name']:>{width + 2}}" for c in configs) + ("  change" if len(configs) == 2 else ""))
+    for key, label, fmt in METRICS:
+        row = f"{label:<26}" + "".join(f"{fmt.format(s[key]):>{width + 2}}" for s in summaries)
+        if len(summaries) == 2 and summaries[0][key]:
+            row += f"  {(summaries[1][key] - summaries[0][key]) / summaries[0][key]:+.1%}"
+        print(row)
+
+
+def compare(samples, base, other, show=5):
+    """Samples whose output changed between two configurations, worst regressions first."""
+    changed = [
+        (o["ned"] - b["ned"], sample, b, o)
+        for sample, b, o in zip(samples, base, other)
+        if normalize(b["text"]) != normalize(o["text"])
+    ]
+    worse = sum(1 for delta, *_ in changed if delta > 0)
+    better = sum(1 for delta, *_ in changed if delta < 0)
+    print(f"\n{len(changed)} of {len(samples)} outputs changed: {worse} worse, {better} better")
+    for delta, sample, b, o in sorted(changed, key=lambda item: -item[0])[:show]:
+        if delta <= 0:
+            break
+        print(f"  {sample.id}: edit distance {b['ned']:.3f} -> {o['ned']:.3f}")
+        print(f"    label: {sample.label[:100]}")
+        print(f"    base:  {b['text'][:100]}")
+        print(f"    new:   {o['text'][:100]}")
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate MixTeX accuracy and speed over labelled samples")
+    parser.add_argument("--metadata", action="append", default=[], help="GUI metadata.csv (images beside it)")
+    parser.add_argument("--shard", action="append", default=[], help="labelled .mxshard file")
+    parser.add_argument("--feedback", action="append", help="feedback tags to include (default: Perfect)")
+    parser.add_argument("--config", action="append", type=parse_config, help="key=value,... (repeatable)")
+    parser.add_argument("--limit", type=int, help="evaluate only the first N samples")
+    parser.add_argument("--json", help="write summaries and per-sample outputs to this file")
+    parser.add_argument(
+        "--max-ned-increase",
+        type=float,
+        help="exit with status 1 if the second config's mean edit distance exceeds the first's by more than this",
+    )
+    args = parser.parse_args()
+
+    feedback = tuple(args.feedback or ("Perfect",))
+    samples = []
+    for path in args.metadata:
+        samples += load_metadata(path, feedback)
+    for path in args.shard:
+        samples += load_shard(path, feedback)
+    samples = samples[: args.limit] if args.limit else samples
+    if not samples:
+        sys.exit("No labelled samples found (pass --metadata or --shard)")
+    configs = args.config or [parse_config("name=default")]
+
+    print(f"Evaluating {len(samples)} samples")
+    all_results, summaries = [], []
+    for config in configs:
+        results, elapsed = run_config(samples, config)
+        all_results.append(results)
+        summaries.append(summarize(samples, results, elapsed))
+        print(f"  {config['name']}: {elapsed:.1f}s")
+    print()
+    print_report(configs, summaries)
+    if len(configs) == 2:
+        compare(samples, *all_results)
+
+    if args.json:
+        report = {
+            "configs": configs,
+            "summaries": summaries,
+            "samples": [
+                {"id": s.id, "label": s.label, "outputs": [r[i] for r in all_results]}
+                for i, s in enumerate(samples)
+            ],
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.max_ned_increase is not None and len(summaries) >= 2:
+        increase = summaries[1]["mean_ned"] - summaries[0]["mean_ned"]
+        if increase > args.max_ned_increase:
+            sys.exit(f"Mean edit distance rose by {increase:.4f} (allowed {args.max_ned_increase})")
+
+
+if __name__ == "__main__":
+    main()
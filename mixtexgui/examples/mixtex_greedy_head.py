@@ -0,0 +1,131 @@
+"""
+Export a decoder that picks the next token in-graph.
+
+decoder_model_merged.onnx returns logits for every position and the whole
+vocabulary, (batch, seq, 30002) floats per step, of which greedy decoding
+only needs the argmax of the last position. This tool appends
+
+    logits -> Slice(last position) -> ArgMax -> next_token (batch, 1) int64
+
+and removes logits from the outputs, so each step hands 8 bytes per image
+back to Python instead of ~120 KB. present.* outputs keep their positions,
+so the KV-cache plumbing is unchanged. With --top-k K it also adds
+top_k_ids and top_k_logprobs (batch, 1, K) for callers that want scores.
+
+    python mixtex_greedy_head.py --model-dir ../onnx [--top-k 5]
+
+writes decoder_model_greedy.onnx, which load_model() prefers and
+decode_stream() detects by its next_token output. Requires the onnx package
+(only for this conversion).
+"""
+
+import argparse
+import os
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from PIL import Image, ImageDraw
+
+from mixtex_core import GREEDY_DECODER, GREEDY_OUTPUT, decode_stream, encode, load_model
+
+PREFIX = "greedy_head/"
+
+
+def add_greedy_head(model, top_k=0):
+    """Rewrite model in place: logits output -> next_token (and optional top-k outputs)."""
+    graph = model.graph
+    outputs = list(graph.output)
+    if outputs[0].name != "logits":
+        raise ValueError(f"expected logits as the first output, found {outputs[0].name!r}")
+    batch_dim = outputs[0].type.tensor_type.shape.dim[0]
+    batch = batch_dim.dim_param or batch_dim.dim_value or "batch_size"
+
+    graph.initializer.extend(
+        [
+            numpy_helper.from_array(np.array([-1], np.int64), PREFIX + "starts"),
+            numpy_helper.from_array(np.array([np.iinfo(np.int64).max], np.int64), PREFIX + "ends"),
+            numpy_helper.from_array(np.array([1], np.int64), PREFIX + "axes"),
+        ]
+    )
+    last = PREFIX + "last_logits"
+    nodes = [
+        helper.make_node(
+            "Slice", ["logits", PREFIX + "starts", PREFIX + "ends", PREFIX + "axes"], [last], name=PREFIX + "slice"
+        ),
+        helper.make_node("ArgMax", [last], [GREEDY_OUTPUT], axis=-1, keepdims=0, name=PREFIX + "argmax"),
+    ]
+    new_outputs = [helper.make_tensor_value_info(GREEDY_OUTPUT, TensorProto.INT64, [batch, 1])]
+    if top_k:
+        graph.initializer.append(numpy_helper.from_array(np.array([top_k], np.int64), PREFIX + "k"))
+        logprobs = PREFIX + "logprobs"
+        nodes += [
+            helper.make_node("LogSoftmax", [last], [logprobs], axis=-1, name=PREFIX + "log_softmax"),
+            helper.make_node(
+                "TopK", [logprobs, PREFIX + "k"], ["top_k_logprobs", "top_k_ids"], axis=-1, name=PREFIX + "top_k"
+            ),
+        ]
+        elem_type = outputs[0].type.tensor_type.elem_type
+        extra_outputs = [
+            helper.make_tensor_value_info("top_k_ids", TensorProto.INT64, [batch, 1, top_k]),
+            helper.make_tensor_value_info("top_k_logprobs", elem_type, [batch, 1, top_k]),
+        ]
+    else:
+        extra_outputs = []
+    graph.node.extend(nodes)
+
+    # next_token takes the place of logits so present.* keep their indices
+    del graph.output[:]
+    graph.output.extend(new_outputs + outputs[1:] + extra_outputs)
+    return model
+
+
+def export(model_dir, top_k=0):
+    src = os.path.join(model_dir, "decoder_model_merged.onnx")
+    dst = os.path.join(model_dir, GREEDY_DECODER + ".onnx")
+    model = add_greedy_head(onnx.load(src), top_k)
+    # Protobuf cannot serialize more than 2 GB in one message
+    large = model.ByteSize() >= 2**31
+    if not large:
+        onnx.checker.check_model(model)
+    onnx.save_model(
+        model,
+        dst + ".tmp",
+        save_as_external_data=large,
+        location=os.path.basename(dst) + ".data",
+    )
+    os.replace(dst + ".tmp", dst)
+    return dst
+
+
+def verify(model_dir, steps=32):
+    """Decode a test image with both decoders and check they emit the same tokens."""
+    image = Image.new("RGB", (448, 448), "white")
+    ImageDraw.Draw(image).text((150, 210), "x^2 + y^2 = z^2", fill="black")
+    outputs = []
+    for greedy_head in (False, True):
+        model = load_model(model_dir, greedy_head=greedy_head)
+        outputs.append(list(decode_stream(encode(image, model), model, max_length=steps)))
+    if outputs[0] != outputs[1]:
+        raise RuntimeError(f"greedy-head decoder diverged:\n  {outputs[0]}\n  {outputs[1]}")
+    return len(outputs[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a MixTeX decoder with in-graph greedy token selection")
+    parser.add_argument(
+        "--model-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+    )
+    parser.add_argument("--top-k", type=int, default=0, help="also output the top K token ids and log-probs")
+    parser.add_argument("--no-verify", action="store_true")
+    args = parser.parse_args()
+
+    dst = export(args.model_dir, args.top_k)
+    print(f"Wrote {dst}")
+    if not args.no_verify:
+        tokens = verify(args.model_dir)
+        print(f"Verified: identical output over {tokens} decoded tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Memory accounting for MixTeX processes (Linux /proc).
+
+Shared versus private memory: with load_model(..., shared_weights=True) the
+weights are file mappings that every replica shares; without it each process
+holds them in private memory. Private memory is what each extra replica
+costs, and PSS splits shared pages evenly between the processes mapping them.
+
+    python mixtex_memory.py            # every process mapping ONNX models
+    python mixtex_memory.py PID [PID ...]
+
+Where memory goes during inference: MemoryTracer plugs into the tracer
+argument of mixtex_core and records RSS and peak RSS per stage (encoder,
+decoder steps with their KV-cache size, detokenize, ...). native_heap()
+reports the C heap, where the ONNX Runtime arenas live, and tracemalloc_top()
+the Python lines holding the most memory.
+
+    python mixtex_memory.py --stages test.png [--iterations 20]
+    python mixtex_memory.py --soak test.png --iterations 2000 --max-growth-mb 32
+
+--soak runs inference repeatedly and exits with status 1 if RSS is still
+growing by more than --max-growth-mb after the warm-up iterations.
+"""
+
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import gc
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+WEIGHT_SUFFIXES = (".onnx", ".onnx.data", ".ort")
+
+_SMAPS_HEADER = re.compile(r"^[0-9a-f]+-[0-9a-f]+ ")
+
+
+def _kb_fields(lines):
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def _split(fields):
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def weight_mappings(pid="self"):
+    """Per model file mapped by pid: rss/pss/shared/private in kB."""
+    mappings = {}
+    path = None
+    fields = {}
+
+    def flush():
+        if path is not None and path.endswith(WEIGHT_SUFFIXES):
+            total = mappings.setdefault(path, dict.fromkeys(_split({}), 0))
+            for key, value in _split(fields).items():
+                total[key] += value
+
+    with open(f"/proc/{pid}/smaps", encoding="utf-8") as f:
+        for line in f:
+            if _SMAPS_HEADER.match(line):
+                flush()
+                parts = line.split(None, 5)
+                path = parts[5].strip() if len(parts) == 6 else None
+                fields = {}
+            else:
+                fields.update(_kb_fields([line]))
+    flush()
+    return mappings
+
+
+def memory_report(pid="self"):
+    """
+    Whole-process rss/pss/shared/private/anonymous (kB) from smaps_rollup,
+    plus the model files it maps under "weights". Raises OSError where
+    /proc is unavailable (non-Linux).
+    """
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+        fields = _kb_fields(f)
+    report = {"pid": os.getpid() if pid == "self" else int(pid), **_split(fields)}
+    report["anonymous_kb"] = fields.get("Anonymous", 0)
+    report["weights"] = weight_mappings(pid)
+    return report
+
+
+_PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+
+def rss_kb():
+    """Current resident set size of this process (kB)."""
+    with open("/proc/self/statm", encoding="utf-8") as f:
+        return int(f.read().split()[1]) * _PAGE_KB
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process (kB) since start or reset_peak_rss()."""
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS counter (Linux 4.0+); returns False where that is not possible."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [
+        (name, ctypes.c_size_t)
+        for name in (
+            "arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks", "fsmblks", "uordblks", "fordblks", "keepcost"
+        )
+    ]
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c")) if ctypes.util.find_library("c") else None
+if _libc is not None and hasattr(_libc, "mallinfo2"):
+    _libc.mallinfo2.restype = _MallInfo2
+else:
+    _libc = None
+
+
+def native_heap():
+    """
+    glibc malloc statistics (kB): in_use (allocated, including mmapped
+    blocks), free (held by malloc but unused), mmapped. ONNX Runtime's CPU
+    arenas and numpy buffers are allocated here; None without glibc 2.33+.
+    """
+    if _libc is None:
+        return None
+    info = _libc.mallinfo2()
+    return {
+        "in_use_kb": (info.uordblks + info.hblkhd) // 1024,
+        "free_kb": info.fordblks // 1024,
+        "mmapped_kb": info.hblkhd // 1024,
+    }
+
+
+def tracemalloc_top(limit=10, key_type="lineno"):
+    """The Python allocation sites holding the most memory, or None if tracemalloc is not tracing."""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+    )
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_kb": current // 1024,
+        "peak_kb": peak // 1024,
+        "top": [
+            {"location": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:limit]
+        ],
+    }
+
+
+class MemoryTracer:
+    """
+    A mixtex_core tracer that records memory instead of time: per stage,
+    the RSS change across it and the peak RSS reached inside it, plus the
+    largest KV cache seen by decoder steps. Readings are process-wide, so
+    stages of concurrent requests blur into each other, and with
+    reset_peaks each span resets the peak counter (nested spans would reset
+    their parent's).
+    """
+
+    enabled = True
+
+    def __init__(self, reset_peaks=True):
+        self.reset_peaks = reset_peaks and reset_peak_rss()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        if self.reset_peaks:
+            reset_peak_rss()
+        before = rss_kb()
+        try:
+            yield
+        finally:
+            after = rss_kb()
+            peak = peak_rss_kb() if self.reset_peaks else after
+            with self._lock:
+                stage = self.stages.setdefault(
+                    name,
+                    {"count": 0, "rss_delta_kb": 0, "max_rss_delta_kb": 0, "peak_rss_kb": 0, "rss_kb": 0},
+                )
+                stage["count"] += 1
+                stage["rss_delta_kb"] += after - before
+                stage["max_rss_delta_kb"] = max(stage["max_rss_delta_kb"], after - before)
+                stage["peak_rss_kb"] = max(stage["peak_rss_kb"], peak)
+                stage["rss_kb"] = after
+                if "kv_bytes" in args:
+                    stage["max_kv_cache_kb"] = max(stage.get("max_kv_cache_kb", 0), args["kv_bytes"] // 1024)
+
+    def record(self, name, start, end, **args):
+        pass  # spans timed elsewhere carry no memory readings
+
+    def report(self):
+        with self._lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+
+def find_model_processes():
+    """PIDs of processes (readable by us) that map an ONNX model file."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/maps", encoding="utf-8") as f:
+                if any(line.rstrip().endswith(WEIGHT_SUFFIXES) for line in f):
+                    pids.append(int(entry))
+        except OSError:
+            pass
+    return pids
+
+
+def _command(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode("utf-8", "replace").strip()
+    except OSError:
+        return "?"
+
+
+def _mib(kb):
+    return f"{kb / 1024:.1f}"
+
+
+def _load(model_dir, image_path, shared_weights=False):
+    # Imported here so that the process table above needs no model dependencies
+    from PIL import Image
+
+    from mixtex_core import load_model, pad_image
+
+    model = load_model(model_dir, shared_weights=shared_weights)
+    return model, pad_image(Image.open(image_path).convert("RGB"))
+
+
+def _infer(image, model, tracer=None):
+    from mixtex_core import stream_inference
+    from mixtex_trace import NULL_TRACER
+
+    return "".join(stream_inference(image, model, tracer=tracer or NULL_TRACER))
+
+
+def stage_report(model_dir, image_path, iterations=20, top=10, shared_weights=False):
+    """Run inference under a MemoryTracer (and tracemalloc when top > 0); returns a report dict."""
+    if top:
+        tracemalloc.start()
+    model, image = _load(model_dir, image_path, shared_weights)
+    tracer = MemoryTracer()
+    for _ in range(iterations):
+        _infer(image, model, tracer)
+    report = {"process": memory_report(), "native_heap": native_heap(), "stages": tracer.report()}
+    if top:
+        report["tracemalloc"] = tracemalloc_top(top)
+        tracemalloc.stop()
+    return report
+
+
+def soak(model_dir, image_path, iterations=2000, warmup_iterations=50, samples=20, shared_weights=False,
+         progress=None):
+    """
+    Run iterations inferences and sample RSS (after gc) at samples evenly
+    spaced points past the warm-up. growth_kb compares the median of the
+    last three samples with the first three; slope_kb is a least-squares
+    fit per 1000 iterations.
+    """
+    model, image = _load(model_dir, image_path, shared_weights)
+    for _ in range(warmup_iterations):
+        _infer(image, model)
+    every = max(1, iterations // samples)
+    points = []
+    started = time.perf_counter()
+    for i in range(1, iterations + 1):
+        _infer(image, model)
+        if i % every == 0 or i == iterations:
+            gc.collect()
+            points.append((i, rss_kb()))
+            if progress:
+                progress(i, points[-1][1], time.perf_counter() - started)
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0.0
+    return {
+        "iterations": iterations,
+        "samples": points,
+        "growth_kb": sorted(ys[-3:])[len(ys[-3:]) // 2] - sorted(ys[:3])[len(ys[:3]) // 2],
+        "slope_kb": round(slope * 1000, 1),
+        "native_heap": native_heap(),
+    }
+
+
+def _print_stages(report):
+    print(f"{'stage':<22} {'count':>7} {'rss change':>12} {'max':>8} {'peak rss':>9} {'max kv':>8}   (MiB)")
+    for name, stage in report["stages"].items():
+        kv = stage.get("max_kv_cache_kb")
+        print(
+            f"{name:<22} {stage['count']:>7} {_mib(stage['rss_delta_kb']):>12} {_mib(stage['max_rss_delta_kb']):>8} "
+            f"{_mib(stage['peak_rss_kb']):>9} {_mib(kv) if kv is not None else '-':>8}"
+        )
+    process, heap = report["process"], report["native_heap"]
+    print(f"\nprocess: rss {_mib(process['rss_kb'])} MiB, anonymous {_mib(process['anonymous_kb'])} MiB")
+    if heap:
+        print(f"native heap (ORT arenas, numpy): {_mib(heap['in_use_kb'])} MiB in use, "
+              f"{_mib(heap['free_kb'])} MiB free")
+    top = report.get("tracemalloc")
+    if top:
+        print(f"\ntracemalloc: {_mib(top['traced_kb'])} MiB traced (peak {_mib(top['peak_kb'])} MiB)")
+        for stat in top["top"]:
+            print(f"  {stat['size_kb']:>10.1f} kB {stat['count']:>7}  {stat['location']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory accounting for MixTeX processes and inference")
+    parser.add_argument("pids", nargs="*", type=int, help="processes to report (default: all mapping ONNX models)")
+    parser.add_argument("--stages", metavar="IMAGE", help="run inference on IMAGE and report memory per stage")
+    parser.add_argument("--soak", metavar="IMAGE", help="run inference on IMAGE repeatedly and check RSS growth")
+    parser.add_argument("--iterations", type=int, help="inferences to run (default: 20 for --stages, 2000 for --soak)")
+    parser.add_argument("--warmup-iterations", type=int, default=50, help="--soak: inferences before measuring")
+    parser.add_argument("--max-growth-mb", type=float, default=32.0, help="--soak: allowed RSS growth")
+    parser.add_argument("--top", type=int, default=10, help="--stages: tracemalloc top allocators (0 disables)")
+    parser.add_argument(
+        "--model-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+    )
+    parser.add_argument(
+        "--shared-weights", action="store_true", help="memory-map *.shared.onnx (see mixtex_share_weights.py)"
+    )
+    args = parser.parse_args()
+
+    if args.stages:
+        _print_stages(stage_report(args.model_dir, args.stages, args.iterations or 20, args.top, args.shared_weights))
+        return
+    if args.soak:
+        def progress(i, rss, elapsed):
+            print(f"  {i:>7} inferences  rss {_mib(rss)} MiB  {elapsed:.0f}s", flush=True)
+
+        result = soak(
+            args.model_dir, args.soak, args.iterations or 2000, args.warmup_iterations,
+            shared_weights=args.shared_weights, progress=progress,
+        )
+        growth_mb = result["growth_kb"] / 1024
+        print(f"RSS growth {growth_mb:+.1f} MiB over {result['iterations']} inferences "
+              f"(trend {result['slope_kb'] / 1024:+.2f} MiB per 1000)")
+        if growth_mb > args.max_growth_mb:
+            sys.exit(f"FAIL: RSS grew by more than {args.max_growth_mb} MiB")
+        print("OK")
+        return
+
+    pids = args.pids or find_model_processes()
+    if not pids:
+        sys.exit("No processes mapping ONNX model files found")
+    print("Memory in MiB; weights = mapped model files, w.shared = the part shared with other processes")
+    print(f"{'pid':>7} {'rss':>8} {'pss':>8} {'shared':>8} {'private':>8} {'weights':>8} {'w.shared':>8}  command")
+    for pid in pids:
+        try:
+            r = memory_report(pid)
+        except OSError as e:
+            print(f"{pid:>7} {e}")
+            continue
+        weights_rss = sum(w["rss_kb"] for w in r["weights"].values())
+        weights_shared = sum(w["shared_kb"] for w in r["weights"].values())
+        print(
+            f"{pid:>7} {_mib(r['rss_kb']):>8} {_mib(r['pss_kb']):>8} {_mib(r['shared_kb']):>8} "
+            f"{_mib(r['private_kb']):>8} {_mib(weights_rss):>8} {_mib(weights_shared):>8}  {_command(pid)[:60]}"
+        )
+
+
+if __name__ == "__main__":
+    main()
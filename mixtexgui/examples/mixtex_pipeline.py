@@ -0,0 +1,219 @@
+"""
+Pipelined OCR over many images.
+
+stream_inference handles one image at a time: preprocessing, then the
+encoder, then the whole decoder loop, and only then the next image. For
+directories, PDFs and batch jobs that leaves the CPU-heavy stages idle while
+the decoder loops. OCRPipeline overlaps them:
+
+    load + pad (thread pool) -> encoder (batched) -> decoder (thread pool)
+
+Stages are connected by bounded queues, so a slow stage back-pressures the
+ones before it instead of buffering the whole job in memory. Encoder
+outputs are handed to the decoder stage as views into the batch output,
+without copying.
+"""
+
+import queue
+import threading
+import time
+
+from PIL import Image
+
+from mixtex_core import decode_stream, encode, estimate_token_budget, pad_image
+
+_DONE = object()
+
+
+def load_padded(item):
+    """Default loader: a path, bytes-like file object or PIL image -> padded RGB image."""
+    image = item if isinstance(item, Image.Image) else Image.open(item)
+    return pad_image(image.convert("RGB"))
+
+
+class PipelineResult:
+    __slots__ = ("index", "item", "text", "info", "error")
+
+    def __init__(self, index, item, text=None, info=None, error=None):
+        self.index = index
+        self.item = item
+        self.text = text
+        self.info = info or {}
+        self.error = error
+
+
+class OCRPipeline:
+    """
+    model: a loaded model tuple (see mixtex_core.load_model; give the
+        encoder and decoder sessions their own intra-op thread counts there)
+    preprocess_workers: threads decoding and padding images
+    encoder_batch_size: images per encoder run
+    decoder_workers: images decoded concurrently
+    queue_size: capacity of each inter-stage queue
+    batch_timeout: seconds the encoder waits to fill a batch once it has one image
+    loader: item -> padded PIL image (default: load_padded)
+    max_tokens: int, "auto" or None, as in stream_inference
+    """
+
+    def __init__(
+        self,
+        model,
+        preprocess_workers=2,
+        encoder_batch_size=4,
+        decoder_workers=2,
+        queue_size=8,
+        batch_timeout=0.01,
+        loader=load_padded,
+        max_length=512,
+        max_tokens=None,
+    ):
+        self.model = model
+        self.preprocess_workers = preprocess_workers
+        self.encoder_batch_size = encoder_batch_size
+        self.decoder_workers = decoder_workers
+        self.queue_size = queue_size
+        self.batch_timeout = batch_timeout
+        self.loader = loader
+        self.max_length = max_length
+        self.max_tokens = max_tokens
+
+    def map(self, items):
+        """Run OCR over items, yielding PipelineResults in completion order."""
+        load_q = queue.Queue(self.queue_size)
+        encode_q = queue.Queue(self.queue_size)
+        decode_q = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        stop = threading.Event()
+
+        def put(q, value):
+            # Blocking put that gives up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def take(q, timeout=None):
+            # Blocking get that returns _DONE once the consumer has gone away
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            while not stop.is_set():
+                wait = 0.1 if deadline is None else min(0.1, deadline - time.perf_counter())
+                if wait <= 0:
+                    return q.get_nowait()
+                try:
+                    return q.get(timeout=wait)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def feed():
+            # The sentinels go out even if iterating items fails, or map() would wait forever
+            index = 0
+            try:
+                for index, item in enumerate(items):
+                    if not put(load_q, (index, item)):
+                        return
+                    index += 1
+            except Exception as e:
+                put(results, PipelineResult(index, None, error=e))
+            finally:
+                for _ in range(self.preprocess_workers):
+                    put(load_q, _DONE)
+
+        def preprocess():
+            while True:
+                job = take(load_q)
+                if job is _DONE:
+                    put(encode_q, _DONE)
+                    return
+                index, item = job
+                try:
+                    image = self.loader(item)
+                except Exception as e:
+                    put(results, PipelineResult(index, item, error=e))
+                    continue
+                if not put(encode_q, (index, item, image)):
+                    return
+
+        def encoder():
+            finished = 0
+            while finished < self.preprocess_workers and not stop.is_set():
+                batch = []
+                job = take(encode_q)
+                batch_deadline = time.perf_counter() + self.batch_timeout
+                while True:
+                    if job is _DONE:
+                        finished += 1
+                    else:
+                        batch.append(job)
+                    if len(batch) >= self.encoder_batch_size or finished == self.preprocess_workers:
+                        break
+                    try:
+                        job = take(encode_q, batch_deadline - time.perf_counter())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    continue
+                try:
+                    enc_out = encode([image for _, _, image in batch], self.model)
+                except Exception as e:
+                    for index, item, _ in batch:
+                        put(results, PipelineResult(index, item, error=e))
+                    continue
+                for row, (index, item, image) in enumerate(batch):
+                    # Basic slicing: a view into the batch output, no copy
+                    if not put(decode_q, (index, item, image, enc_out[row : row + 1])):
+                        return
+            for _ in range(self.decoder_workers):
+                put(decode_q, _DONE)
+
+        def decoder():
+            while True:
+                job = take(decode_q)
+                if job is _DONE:
+                    put(results, _DONE)
+                    return
+                index, item, image, enc_out = job
+                started = time.perf_counter()
+                info = {}
+                try:
+                    max_tokens = self.max_tokens
+                    if max_tokens == "auto":
+                        max_tokens = estimate_token_budget(image, self.max_length)
+                    text = "".join(
+                        decode_stream(
+                            enc_out, self.model, self.max_length, max_tokens=max_tokens, info=info
+                        )
+                    )
+                except Exception as e:
+                    put(results, PipelineResult(index, item, error=e))
+                    continue
+                info["seconds"] = round(time.perf_counter() - started, 4)
+                put(results, PipelineResult(index, item, text, info))
+
+        threads = [threading.Thread(target=feed, name="ocr-feed", daemon=True)]
+        threads += [
+            threading.Thread(target=preprocess, name=f"ocr-preprocess-{i}", daemon=True)
+            for i in range(self.preprocess_workers)
+        ]
+        threads.append(threading.Thread(target=encoder, name="ocr-encoder", daemon=True))
+        threads += [
+            threading.Thread(target=decoder, name=f"ocr-decoder-{i}", daemon=True)
+            for i in range(self.decoder_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            remaining = self.decoder_workers
+            while remaining:
+                result = results.get()
+                if result is _DONE:
+                    remaining -= 1
+                else:
+                    yield result
+        finally:
+            # Consumer stopped early: unblock every stage so the threads exit
+            stop.set()
@@ -0,0 +1,277 @@
+"""
+Packed dataset shards for MixTeX samples.
+
+A shard is a single file holding many (text, image, meta) records, so that
+generated documents and feedback samples can be listed, copied and streamed
+into training without one file open per sample.
+
+Layout (all integers little-endian):
+
+    b"MXSHARD1"                                   file header
+    repeated records:
+        b"MXR1" text_len:u32 image_len:u32 meta_len:u32
+        text (utf-8) | image bytes | meta (utf-8 JSON)
+    b"MXIX" offset:u64 * count                    record index
+    index_offset:u64 count:u64 b"MXFOOTER"        footer
+
+Every record carries its own header, so a shard can be read front to back
+from a pipe without the index, and a shard whose index was lost (e.g. an
+interrupted append) is recovered by scanning the records.
+"""
+
+import io
+import json
+import mmap
+import os
+import struct
+
+FILE_MAGIC = b"MXSHARD1"
+RECORD_MAGIC = b"MXR1"
+INDEX_MAGIC = b"MXIX"
+FOOTER_MAGIC = b"MXFOOTER"
+SHARD_SUFFIX = ".mxshard"
+
+_RECORD_HEADER = struct.Struct("<4sIII")
+_FOOTER = struct.Struct("<QQ8s")
+_OFFSET = struct.Struct("<Q")
+
+
+class ShardRecord:
+    __slots__ = ("text", "image", "meta")
+
+    def __init__(self, text, image, meta):
+        self.text = text
+        self.image = image
+        self.meta = meta
+
+    def open_image(self):
+        """Decode the stored image bytes with PIL (None if there is no image)."""
+        if not self.image:
+            return None
+        from PIL import Image
+
+        return Image.open(io.BytesIO(self.image))
+
+    def __repr__(self):
+        return f"ShardRecord(text={self.text[:30]!r}, image={len(self.image)} bytes, meta={self.meta!r})"
+
+
+def _encode_image(image):
+    if image is None:
+        return b""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _decode_record(buf, offset):
+    magic, text_len, image_len, meta_len = _RECORD_HEADER.unpack_from(buf, offset)
+    if magic != RECORD_MAGIC:
+        raise ValueError(f"Corrupt shard: no record at offset {offset}")
+    pos = offset + _RECORD_HEADER.size
+    text = bytes(buf[pos : pos + text_len]).decode("utf-8")
+    pos += text_len
+    image = bytes(buf[pos : pos + image_len])
+    pos += image_len
+    meta = json.loads(bytes(buf[pos : pos + meta_len])) if meta_len else {}
+    return ShardRecord(text, image, meta), pos + meta_len
+
+
+def _scan_offsets(buf, start, end):
+    """Rebuild the record index by walking record headers."""
+    offsets = []
+    pos = start
+    while pos + _RECORD_HEADER.size <= end:
+        magic, text_len, image_len, meta_len = _RECORD_HEADER.unpack_from(buf, pos)
+        next_pos = pos + _RECORD_HEADER.size + text_len + image_len + meta_len
+        if magic != RECORD_MAGIC or next_pos > end:
+            break
+        offsets.append(pos)
+        pos = next_pos
+    return offsets, pos
+
+
+class ShardReader:
+    """Random-access reader over a memory-mapped shard."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(FILE_MAGIC):
+            self._file.close()
+            raise ValueError(f"Not a MixTeX shard: {path}")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(FILE_MAGIC)] != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"Not a MixTeX shard: {path}")
+        self.offsets, self.data_end = self._read_index(size)
+
+    def _read_index(self, size):
+        if size >= len(FILE_MAGIC) + _FOOTER.size:
+            index_offset, count, magic = _FOOTER.unpack_from(self._mm, size - _FOOTER.size)
+            index_end = index_offset + len(INDEX_MAGIC) + count * _OFFSET.size
+            if (
+                magic == FOOTER_MAGIC
+                and index_end == size - _FOOTER.size
+                and self._mm[index_offset : index_offset + len(INDEX_MAGIC)] == INDEX_MAGIC
+            ):
+                start = index_offset + len(INDEX_MAGIC)
+                offsets = list(struct.unpack_from(f"<{count}Q", self._mm, start))
+                return offsets, index_offset
+        # No valid footer: the writer was interrupted, recover from the records
+        return _scan_offsets(self._mm, len(FILE_MAGIC), size)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        return _decode_record(self._mm, self.offsets[i])[0]
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield _decode_record(self._mm, offset)[0]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_shard_stream(fileobj):
+    """Yield records sequentially from a file object, without seeking or the index."""
+    if fileobj.read(len(FILE_MAGIC)) != FILE_MAGIC:
+        raise ValueError("Not a MixTeX shard stream")
+    while True:
+        header = fileobj.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size or header[:4] != RECORD_MAGIC:
+            return
+        _, text_len, image_len, meta_len = _RECORD_HEADER.unpack(header)
+        body = fileobj.read(text_len + image_len + meta_len)
+        if len(body) < text_len + image_len + meta_len:
+            return
+        yield _decode_record(header + body, 0)[0]
+
+
+class ShardWriter:
+    """
+    Write records to a shard.
+
+    New shards are written to a temporary file and renamed into place on
+    close, so readers never observe a half-written shard. With append=True
+    an existing shard is extended in place: its index is dropped, records are
+    added after the last one and a fresh index is written on close.
+    Leaving a with block by an exception calls abort() instead of close().
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.offsets = []
+        if append and os.path.exists(path):
+            with ShardReader(path) as reader:
+                self.offsets = list(reader.offsets)
+                data_end = reader.data_end
+            self._tmp_path = None
+            self._file = open(path, "r+b")
+            self._file.truncate(data_end)
+            self._file.seek(data_end)
+        else:
+            self._tmp_path = path + ".tmp"
+            self._file = open(self._tmp_path, "wb")
+            self._file.write(FILE_MAGIC)
+
+    def add(self, text, image=None, meta=None):
+        """Append a record. image may be encoded bytes or a PIL image (stored as PNG)."""
+        text_bytes = text.encode("utf-8")
+        image_bytes = _encode_image(image)
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8") if meta else b""
+        self.offsets.append(self._file.tell())
+        self._file.write(_RECORD_HEADER.pack(RECORD_MAGIC, len(text_bytes), len(image_bytes), len(meta_bytes)))
+        self._file.write(text_bytes)
+        self._file.write(image_bytes)
+        self._file.write(meta_bytes)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        if self._file is None:
+            return
+        index_offset = self._file.tell()
+        self._file.write(INDEX_MAGIC)
+        self._file.write(struct.pack(f"<{len(self.offsets)}Q", *self.offsets))
+        self._file.write(_FOOTER.pack(index_offset, len(self.offsets), FOOTER_MAGIC))
+        self._file.close()
+        self._file = None
+        if self._tmp_path is not None:
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """
+        Stop without publishing: a new shard's temporary file is deleted; an
+        appended shard is left without an index, so readers recover the
+        records written so far by scanning.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._tmp_path is not None:
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def pack_feedback_folder(data_folder, shard_path):
+    """Pack a GUI feedback folder (metadata.csv plus one PNG per row) into a shard."""
+    import csv
+
+    with open(os.path.join(data_folder, "metadata.csv"), newline="", encoding="utf-8") as f, ShardWriter(
+        shard_path
+    ) as writer:
+        for row in csv.DictReader(f):
+            image_path = os.path.join(data_folder, row["file_name"])
+            image = None
+            if os.path.exists(image_path):
+                with open(image_path, "rb") as img_file:
+                    image = img_file.read()
+            writer.add(row["text"], image, {"file_name": row["file_name"], "feedback": row["feedback"]})
+        return len(writer)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or build MixTeX dataset shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="print record count and a preview of a shard")
+    info.add_argument("shard")
+    pack = sub.add_parser("pack-feedback", help="pack a feedback folder (metadata.csv + PNGs)")
+    pack.add_argument("data_folder")
+    pack.add_argument("shard")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        with ShardReader(args.shard) as reader:
+            print(f"{args.shard}: {len(reader)} records")
+            for i in range(min(len(reader), 5)):
+                print(f"  [{i}] {reader[i]!r}")
+    else:
+        count = pack_feedback_folder(args.data_folder, args.shard)
+        print(f"Packed {count} samples into {args.shard}")
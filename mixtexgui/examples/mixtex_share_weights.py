@@ -0,0 +1,126 @@
+"""
+Re-save the MixTeX ONNX models with their weights in page-aligned external files.
+
+ORT copies weights embedded in an .onnx protobuf into each process's own
+heap. Weights stored as external data, at offsets aligned to the mapping
+granularity (4 KiB pages on Linux, 64 KiB on Windows), are memory-mapped
+read-only instead, so every process loading the model shares one copy
+through the OS page cache. load_model(..., shared_weights=True) loads the
+files written here:
+
+    encoder_model.shared.onnx         + encoder_model.shared.onnx.data
+    decoder_model_merged.shared.onnx  + decoder_model_merged.shared.onnx.data
+    (and decoder_model_greedy.shared.onnx if mixtex_greedy_head.py was run first)
+
+    python mixtex_share_weights.py --model-dir ../onnx
+
+Requires the onnx package (only for this conversion, not for inference).
+"""
+
+import argparse
+import os
+
+import onnx
+from onnx import AttributeProto, TensorProto, numpy_helper
+
+from mixtex_core import SHARED_SUFFIX
+
+MODEL_NAMES = ("encoder_model", "decoder_model_merged", "decoder_model_greedy")
+DEFAULT_ALIGNMENT = 64 * 1024
+
+
+def iter_initializers(graph):
+    """Initializers of graph and of every subgraph (the merged decoder's If branches)."""
+    yield from graph.initializer
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.type == AttributeProto.GRAPH:
+                yield from iter_initializers(attr.g)
+            elif attr.type == AttributeProto.GRAPHS:
+                for subgraph in attr.graphs:
+                    yield from iter_initializers(subgraph)
+
+
+def _set_external(tensor, location, offset, length):
+    del tensor.external_data[:]
+    for key, value in (("location", location), ("offset", str(offset)), ("length", str(length))):
+        entry = tensor.external_data.add()
+        entry.key = key
+        entry.value = value
+    tensor.data_location = TensorProto.EXTERNAL
+    tensor.ClearField("raw_data")
+
+
+def share_model(src_path, dst_path, alignment=DEFAULT_ALIGNMENT, size_threshold=1024):
+    """
+    Write src_path to dst_path with every initializer of at least
+    size_threshold bytes moved to dst_path + ".data" at an aligned offset.
+    Returns (tensor count, bytes externalized).
+    """
+    model = onnx.load(src_path)  # also pulls in any existing external data
+    data_path = dst_path + ".data"
+    location = os.path.basename(data_path)
+    count = total = 0
+    with open(data_path + ".tmp", "wb") as f:
+        for tensor in iter_initializers(model.graph):
+            if tensor.data_type == TensorProto.STRING:
+                continue
+            if not tensor.HasField("raw_data"):
+                # Typed fields (float_data etc.): normalize to raw bytes
+                tensor.CopyFrom(numpy_helper.from_array(numpy_helper.to_array(tensor), tensor.name))
+            data = tensor.raw_data
+            if len(data) < size_threshold:
+                continue
+            f.write(b"\0" * (-f.tell() % alignment))
+            offset = f.tell()
+            f.write(data)
+            _set_external(tensor, location, offset, len(data))
+            count += 1
+            total += len(data)
+    onnx.save_model(model, dst_path + ".tmp")
+    if count:
+        os.replace(data_path + ".tmp", data_path)
+    else:
+        os.remove(data_path + ".tmp")
+    os.replace(dst_path + ".tmp", dst_path)
+    return count, total
+
+
+def _io_names(session):
+    return [i.name for i in session.get_inputs()], [o.name for o in session.get_outputs()]
+
+
+def verify_model(src_path, dst_path):
+    """Check the re-saved model loads and has the same inputs and outputs."""
+    import onnxruntime as ort
+
+    if _io_names(ort.InferenceSession(src_path)) != _io_names(ort.InferenceSession(dst_path)):
+        raise RuntimeError(f"{dst_path} does not match {src_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-save MixTeX models for shared, memory-mapped weights")
+    parser.add_argument(
+        "--model-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+    )
+    parser.add_argument("--alignment", type=int, default=DEFAULT_ALIGNMENT)
+    parser.add_argument("--size-threshold", type=int, default=1024, help="smaller tensors stay inline")
+    parser.add_argument("--no-verify", action="store_true")
+    args = parser.parse_args()
+
+    for name in MODEL_NAMES:
+        src = os.path.join(args.model_dir, f"{name}.onnx")
+        if name == "decoder_model_greedy" and not os.path.exists(src):
+            continue  # optional, see mixtex_greedy_head.py
+        dst = os.path.join(args.model_dir, name + SHARED_SUFFIX)
+        count, total = share_model(src, dst, args.alignment, args.size_threshold)
+        if not args.no_verify:
+            verify_model(src, dst)
+        if count:
+            print(f"{dst}: {count} tensors, {total / 2**20:.1f} MiB in {os.path.basename(dst)}.data")
+        else:
+            print(f"{dst}: no tensors of {args.size_threshold} bytes or more, nothing to share")
+
+
+if __name__ == "__main__":
+    main()
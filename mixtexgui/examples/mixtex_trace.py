@@ -0,0 +1,234 @@
+"""
+Span tracing for the inference path, written as Chrome trace JSON.
+
+mixtex_core functions take a tracer argument that defaults to NULL_TRACER,
+whose span() hands back one shared no-op context manager, so tracing costs
+nothing when it is off. A Tracer records complete ("X") events that open in
+chrome://tracing or Perfetto, and can merge ONNX Runtime profiles (which use
+the same event format) onto the same timeline.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import onnxruntime as ort
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class NullTracer:
+    enabled = False
+
+    def span(self, name, **args):
+        return _NULL_SPAN
+
+    def record(self, name, start, end, **args):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, t0=None):
+        # t0: perf_counter() reading the timeline starts at (default: now)
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.pid = os.getpid()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, **args):
+        """Add a span from two time.perf_counter() readings."""
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self.t0) * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), **args)
+
+    def add_ort_profile(self, profile_path, started_at, label):
+        """
+        Merge an ONNX Runtime profile file. started_at is the perf_counter()
+        reading taken when the profiled session was created, which is where
+        ORT's timestamps start. Events from before this tracer started (session
+        load, warm-up) are dropped.
+        """
+        with open(profile_path, encoding="utf-8") as f:
+            ort_events = json.load(f)
+        shift = (started_at - self.t0) * 1e6
+        pid = f"{self.pid} {label}"
+        with self._lock:
+            self.events.append(
+                {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": label}}
+            )
+            for event in ort_events:
+                event = dict(event, pid=pid)
+                if "ts" in event:
+                    event["ts"] = event["ts"] + shift
+                    if event["ts"] < 0:
+                        continue
+                self.events.append(event)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f)
+        return path
+
+
+class ProfiledModel:
+    """
+    A model tuple whose ONNX sessions have ORT profiling enabled.
+
+    ORT only profiles sessions created with profiling on, and a session's
+    profile ends for good at end_profiling(), so each profiled run needs
+    fresh sessions. That reloads the weights: ProfilerSlot builds and warms
+    them off the request path. The tokenizer and image processor are
+    shared with the regular model, and its sessions' thread settings are
+    copied; pass the same shared_weights as the regular model so the profile
+    reflects the same session configuration.
+    """
+
+    def __init__(self, model, model_dir, profile_dir, shared_weights=False):
+        # Imported here: mixtex_core itself imports this module
+        from mixtex_core import decoder_name, is_greedy_decoder, model_path, session_options
+        from mixtex_tune import session_settings
+
+        tokenizer, feature_extractor, enc_session, dec_session = model
+        # Profile the same decoder variant the regular model runs
+        decoder = decoder_name(model_dir, shared_weights, is_greedy_decoder(dec_session))
+        self.sessions = []
+        try:
+            for name, regular in (("encoder_model", enc_session), (decoder, dec_session)):
+                opts = session_options(shared_weights=shared_weights, **session_settings(regular))
+                opts.enable_profiling = True
+                opts.profile_file_prefix = os.path.join(profile_dir, f"ort_{name}")
+                started_at = time.perf_counter()
+                session = ort.InferenceSession(model_path(model_dir, name, shared_weights), opts)
+                self.sessions.append((name, session, started_at))
+        except Exception:
+            self.close()
+            raise
+        self.model = (tokenizer, feature_extractor, self.sessions[0][1], self.sessions[1][1])
+
+    def finish(self, tracer):
+        """Stop profiling, merge the ORT profiles into tracer and delete the raw files."""
+        for name, session, started_at in self.sessions:
+            profile_path = session.end_profiling()
+            try:
+                tracer.add_ort_profile(profile_path, started_at, f"ORT {name}")
+            finally:
+                os.remove(profile_path)
+
+    def close(self):
+        """Stop profiling without merging; deletes the raw ORT profiles."""
+        for _, session, _ in self.sessions:
+            os.remove(session.end_profiling())
+
+
+class ProfilerSlot:
+    """
+    Keeps one warmed ProfiledModel ready for the next profiled run.
+
+    The sessions are built and warmed (warm(model), if given) in a background
+    thread on first use, and again after each run ends their profile, so
+    profiled runs neither wait for a weight load nor trace cold sessions.
+    One run at a time holds the sessions.
+    """
+
+    def __init__(self, model, model_dir, profile_dir, shared_weights=False, warm=None):
+        self._args = (model, model_dir, profile_dir, shared_weights)
+        self._warm = warm
+        self._cond = threading.Condition()
+        self._profiled = None
+        self._building = False
+        self._in_use = False
+        self._closed = False
+        self.error = None
+
+    def _build(self):
+        try:
+            os.makedirs(self._args[2], exist_ok=True)
+            profiled = ProfiledModel(*self._args)
+            if self._warm is not None:
+                self._warm(profiled.model)
+            error = None
+        except Exception as e:
+            profiled, error = None, e
+        with self._cond:
+            self._building = False
+            self.error = error
+            if self._closed and profiled is not None:
+                profiled.close()
+            elif profiled is not None:
+                self._profiled = profiled
+            self._cond.notify_all()
+
+    def _start_build(self):
+        # Caller holds self._cond
+        if self._closed or self._building or self._in_use or self._profiled is not None:
+            return
+        self._building = True
+        threading.Thread(target=self._build, name="profiler-build", daemon=True).start()
+
+    def acquire(self, wait=True, timeout=None):
+        """
+        Take the warmed ProfiledModel; release it with finish(). Returns None
+        if it is not ready yet and wait is False (or timeout expires), and
+        raises RuntimeError if building the sessions failed.
+        """
+        with self._cond:
+            self._start_build()
+            if wait:
+                self._cond.wait_for(
+                    lambda: self._profiled is not None
+                    or self._closed
+                    or not (self._building or self._in_use),
+                    timeout,
+                )
+            profiled, self._profiled = self._profiled, None
+            if profiled is not None:
+                self._in_use = True
+            elif wait and self.error is not None:
+                raise RuntimeError(f"Could not create profiled sessions: {self.error}")
+            return profiled
+
+    def finish(self, profiled, tracer):
+        """End the run's profile, merge it into tracer and build the next sessions."""
+        try:
+            profiled.finish(tracer)
+        finally:
+            with self._cond:
+                self._in_use = False
+                self._start_build()
+                self._cond.notify_all()
+
+    def close(self):
+        """Free the idle sessions; the ones in use are freed by finish()."""
+        with self._cond:
+            self._closed = True
+            profiled, self._profiled = self._profiled, None
+            self._cond.notify_all()
+        if profiled is not None:
+            profiled.close()
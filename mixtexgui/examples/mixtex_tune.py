@@ -0,0 +1,323 @@
+"""
+Benchmark ONNX Runtime thread settings and remember the fastest per host.
+
+The encoder is one large ViT pass per image and scales with intra-op
+threads; the decoder runs hundreds of tiny steps, where thread
+synchronization quickly costs more than it saves. The best counts depend on
+the CPU and on how many replicas share it, so they are measured, not
+guessed:
+
+    python mixtex_tune.py --model-dir ../onnx [--max-batch 4] [--replicas 2]
+
+times each session with synthetic inputs at batch sizes 1..--max-batch for
+several intra-op thread counts (up to the usable cores / replicas) and both
+execution modes, then stores the fastest settings in the tuning file
+(MIXTEX_TUNING_FILE, default ~/.cache/mixtex/tuning.json) under a key made
+of the host fingerprint, the model files' hash and the replica count.
+load_model() looks that key up and applies it whenever no thread counts
+are passed explicitly; --show lists the stored entries. Benchmarks and
+writes take a lock next to the tuning file, so replicas starting together
+measure one at a time instead of competing for the same cores.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+import numpy as np
+import onnxruntime as ort
+
+SAMPLE_BYTES = 1024 * 1024
+
+
+def tuning_file():
+    default_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "mixtex")
+    return os.environ.get("MIXTEX_TUNING_FILE", os.path.join(default_dir, "tuning.json"))
+
+
+def usable_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return os.cpu_count() or 1
+
+
+def host_fingerprint():
+    """Short hash of what decides the best settings: CPU model, usable cores, ORT version."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    description = f"{platform.machine()}|{cpu}|{usable_cpus()}|{ort.__version__}"
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+def model_hash(*paths):
+    """
+    Hash of the model files (and their external .data files): size plus the
+    first and last MiB of each, cheap enough to compute on every load.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        for part in (path, path + ".data"):
+            if not os.path.exists(part):
+                continue
+            size = os.path.getsize(part)
+            digest.update(f"{os.path.basename(part)}:{size}:".encode("utf-8"))
+            with open(part, "rb") as f:
+                digest.update(f.read(SAMPLE_BYTES))
+                if size > 2 * SAMPLE_BYTES:
+                    f.seek(-SAMPLE_BYTES, os.SEEK_END)
+                    digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()[:16]
+
+
+def tuning_key(encoder_path, decoder_path, replicas=1):
+    return f"{host_fingerprint()}:{model_hash(encoder_path, decoder_path)}:{replicas}"
+
+
+def load_tuning(path=None):
+    try:
+        with open(path or tuning_file(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def lookup(encoder_path, decoder_path, replicas=1, path=None):
+    """Stored settings for these model files on this host, or None."""
+    return load_tuning(path).get(tuning_key(encoder_path, decoder_path, replicas))
+
+
+@contextlib.contextmanager
+def tuning_lock(path=None):
+    """Exclusive lock on the tuning file across processes (a sibling .lock file)."""
+    path = path or tuning_file()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _store(key, entry, path):
+    # Caller holds tuning_lock; the temp file is unique so readers only ever see a whole file
+    entries = load_tuning(path)
+    entries[key] = entry
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def store(key, entry, path=None):
+    path = path or tuning_file()
+    with tuning_lock(path):
+        _store(key, entry, path)
+
+
+def session_settings(session):
+    """The thread settings a loaded session actually runs with."""
+    options = session.get_session_options()
+    mode = "parallel" if options.execution_mode == ort.ExecutionMode.ORT_PARALLEL else "sequential"
+    return {"intra_op_threads": options.intra_op_num_threads, "execution_mode": mode}
+
+
+def thread_candidates(max_threads):
+    """1, 2, 4, ... up to max_threads, plus max_threads itself."""
+    candidates = {max_threads}
+    n = 1
+    while n < max_threads:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def _median_seconds(run, repeats):
+    run()  # first run allocates arenas and picks kernels
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return sorted(times)[len(times) // 2]
+
+
+def _session(path, settings, shared_weights):
+    from mixtex_core import session_options
+
+    return ort.InferenceSession(path, session_options(shared_weights=shared_weights, **settings))
+
+
+def bench_encoder(path, settings, pixel_batches, repeats, shared_weights=False):
+    """Mean seconds per image over the batches of pixel_values, and the session's effective settings."""
+    session = _session(path, settings, shared_weights)
+    per_image = [
+        _median_seconds(lambda: session.run(None, {"pixel_values": pixels}), repeats) / len(pixels)
+        for pixels in pixel_batches
+    ]
+    return sum(per_image) / len(per_image), session_settings(session)
+
+
+def bench_decoder(path, settings, tokenizer, enc_out, steps, repeats, shared_weights=False):
+    """Mean seconds per decoder step (per image) over the batch sizes in enc_out, and the effective settings."""
+    from mixtex_core import advance_decoder_inputs, init_decoder_inputs, is_greedy_decoder, next_token_ids
+
+    session = _session(path, settings, shared_weights)
+    greedy = is_greedy_decoder(session)
+
+    def decode(batch_out):
+        dec_in = init_decoder_inputs(tokenizer, batch_out)
+        for _ in range(steps):
+            outs = session.run(None, dec_in)
+            advance_decoder_inputs(dec_in, next_token_ids(outs, greedy), outs)
+
+    per_step = [_median_seconds(lambda: decode(batch_out), repeats) / (steps * len(batch_out)) for batch_out in enc_out]
+    return sum(per_step) / len(per_step), session_settings(session)
+
+
+def tune(model_dir, max_batch=4, replicas=1, steps=16, repeats=3, shared_weights=False, greedy_head=True,
+         report=print):
+    """Benchmark both sessions and return (key, entry) for the fastest settings."""
+    from PIL import Image
+    from transformers import AutoImageProcessor, AutoTokenizer
+
+    from mixtex_core import decoder_name, model_path
+
+    encoder_path = model_path(model_dir, "encoder_model", shared_weights)
+    decoder_path = model_path(model_dir, decoder_name(model_dir, shared_weights, greedy_head), shared_weights)
+    max_threads = max(1, usable_cpus() // replicas)
+    batch_sizes = list(range(1, max_batch + 1))
+    threads = thread_candidates(max_threads)
+    report(f"Tuning for {max_threads} threads per replica, batch sizes {batch_sizes}")
+
+    def search(name, bench):
+        # Thread counts in sequential mode first; parallel mode only at the best count,
+        # since it only helps graphs with independent branches
+        results = []
+        for n in threads:
+            settings = {"intra_op_threads": n, "execution_mode": "sequential"}
+            results.append((bench(settings)[0], settings))
+            report(f"  {name:<8} {n:>3} threads  sequential  {1000 * results[-1][0]:8.2f} ms")
+        best = min(results, key=lambda r: r[0])[1]
+        settings = dict(best, execution_mode="parallel")
+        seconds, effective = bench(settings)
+        if effective["execution_mode"] == "parallel":
+            results.append((seconds, settings))
+            report(f"  {name:<8} {best['intra_op_threads']:>3} threads  parallel    {1000 * seconds:8.2f} ms")
+        else:
+            # Some ORT builds and graphs silently fall back to sequential execution
+            report(f"  {name:<8} parallel execution mode not applied by this ONNX Runtime; skipped")
+        return min(results, key=lambda r: r[0])
+
+    # Synthetic inputs: random pixels in the image processor's output shape
+    blank = AutoImageProcessor.from_pretrained(model_dir)(Image.new("RGB", (448, 448), "white"), return_tensors="np")
+    rng = np.random.default_rng(0)
+    pixel_batches = [rng.random((b, *blank.pixel_values.shape[1:]), dtype=np.float32) for b in batch_sizes]
+
+    encoder_seconds, encoder_settings = search(
+        "encoder", lambda s: bench_encoder(encoder_path, s, pixel_batches, repeats, shared_weights)
+    )
+    # Encoder outputs of those pixels are the decoder's inputs, one per batch size
+    encoder = _session(encoder_path, encoder_settings, shared_weights)
+    enc_out = [encoder.run(None, {"pixel_values": pixels})[0] for pixels in pixel_batches]
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    decoder_seconds, decoder_settings = search(
+        "decoder", lambda s: bench_decoder(decoder_path, s, tokenizer, enc_out, steps, repeats, shared_weights)
+    )
+    entry = {
+        "encoder": encoder_settings,
+        "decoder": decoder_settings,
+        "encoder_ms_per_image": round(1000 * encoder_seconds, 3),
+        "decoder_ms_per_step": round(1000 * decoder_seconds, 3),
+        "model_dir": os.path.abspath(model_dir),
+        "files": [os.path.basename(encoder_path), os.path.basename(decoder_path)],
+        "replicas": replicas,
+        "batch_sizes": batch_sizes,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return tuning_key(encoder_path, decoder_path, replicas), entry
+
+
+def tune_once(model_dir, replicas=1, shared_weights=False, greedy_head=True, path=None, **options):
+    """
+    The stored settings for these models on this host, benchmarked and
+    stored first if there are none. Returns (entry, tuned). The lock is held
+    throughout: replicas starting together wait for the first one's result
+    instead of benchmarking on each other's cores.
+    """
+    from mixtex_core import decoder_name, model_path
+
+    path = path or tuning_file()
+    encoder_path = model_path(model_dir, "encoder_model", shared_weights)
+    decoder_path = model_path(model_dir, decoder_name(model_dir, shared_weights, greedy_head), shared_weights)
+    with tuning_lock(path):
+        entry = lookup(encoder_path, decoder_path, replicas, path)
+        if entry is not None:
+            return entry, False
+        key, entry = tune(model_dir, replicas=replicas, shared_weights=shared_weights, greedy_head=greedy_head,
+                          **options)
+        _store(key, entry, path)
+        return entry, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and store the fastest ONNX Runtime thread settings")
+    parser.add_argument(
+        "--model-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "onnx")
+    )
+    parser.add_argument("--max-batch", type=int, default=4, help="benchmark batch sizes 1..N")
+    parser.add_argument("--replicas", type=int, default=1, help="model replicas that will share this host")
+    parser.add_argument("--steps", type=int, default=16, help="decoder steps per timed run")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per configuration (median)")
+    parser.add_argument(
+        "--shared-weights", action="store_true", help="tune the *.shared.onnx models (see mixtex_share_weights.py)"
+    )
+    parser.add_argument("--no-greedy-head", action="store_true", help="tune decoder_model_merged even if greedy exists")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without storing it")
+    parser.add_argument("--show", action="store_true", help="list stored settings and exit")
+    args = parser.parse_args()
+
+    if args.show:
+        print(f"{tuning_file()} (this host: {host_fingerprint()})")
+        for key, entry in load_tuning().items():
+            print(f"  {key}  encoder {entry['encoder']}  decoder {entry['decoder']}  {entry['model_dir']}")
+        return
+
+    # Under the lock: a backend replica tuning at the same time would skew both measurements
+    with tuning_lock():
+        key, entry = tune(
+            args.model_dir, args.max_batch, args.replicas, args.steps, args.repeats, args.shared_weights,
+            not args.no_greedy_head,
+        )
+        print(f"Fastest: encoder {entry['encoder']} ({entry['encoder_ms_per_image']} ms/image), "
+              f"decoder {entry['decoder']} ({entry['decoder_ms_per_step']} ms/step)")
+        if not args.dry_run:
+            _store(key, entry, tuning_file())
+            print(f"Stored under {key} in {tuning_file()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,31 @@
 # Renqing Luo
 # Commercial use prohibited
 import tkinter as tk
+from collections import deque
 from PIL import Image, ImageTk
 import pystray
 from pystray import MenuItem as item
 import threading
-from transformers import RobertaTokenizer, ViTImageProcessor
-import onnxruntime as ort
-import numpy as np
 from PIL import ImageGrab
 import pyperclip
 import time
 import sys
 import os
 import csv
-import re
 import ctypes
 
 if hasattr(sys, '_MEIPASS'):
     base_path = sys._MEIPASS  # type: ignore # PyInstaller attribute
 else:
     base_path = os.path.abspath(".")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples'))
+from mixtex_shard import ShardWriter
+from mixtex_core import InferenceClient, LatexPostprocessor, get_model
 
 class MixTeXApp:
+    LOG_FRAME_MS = 33  # text box refresh interval (~30 fps)
+    LOG_MAX_LINES = 2000  # older lines are dropped from the text box
+
     def __init__(self, root):
         self.root = root
         
@@ -59,12 +62,18 @@ class MixTeXApp:
         self.text_box = tk.Text(self.text_frame, wrap=tk.WORD, bg='white', fg='black', 
                                height=6, width=30, font=('Arial', font_size))
         self.text_box.pack(padx=self.scale_size(2), pady=self.scale_size(2), fill=tk.BOTH, expand=True)
+        # log() may be called from any thread; text is queued here and only the
+        # Tk main loop touches the widget, once per frame (see flush_log)
+        self.log_queue = deque()
+        self.root.after(self.LOG_FRAME_MS, self.flush_log)
 
         self.icon_label.bind('<ButtonPress-1>', self.start_move)
         self.icon_label.bind('<B1-Motion>', self.do_move)
         self.icon_label.bind('<ButtonPress-3>', self.show_menu)
         self.data_folder = "data"
         self.metadata_file = os.path.join(self.data_folder, "metadata.csv")
+        self.feedback_shard_file = os.path.join(self.data_folder, "feedback.mxshard")
+        self.save_feedback_to_shard = False
         self.use_dollars_for_inline_math = False
         self.convert_align_to_equations_enabled = False
         self.ocr_paused = False
@@ -84,6 +93,7 @@ class MixTeXApp:
         settings_menu = tk.Menu(self.menu, tearoff=0)
         settings_menu.add_checkbutton(label="$ Inline Math $", onvalue=1, offvalue=0, command=self.toggle_latex_replacement, variable=tk.BooleanVar(value=self.use_dollars_for_inline_math))
         settings_menu.add_checkbutton(label="$$ Single Line Formula $$", onvalue=1, offvalue=0, command=self.toggle_convert_align_to_equations, variable=tk.BooleanVar(value=self.convert_align_to_equations_enabled))
+        settings_menu.add_checkbutton(label="Pack Feedback into Shard", onvalue=1, offvalue=0, command=self.toggle_feedback_shard, variable=tk.BooleanVar(value=self.save_feedback_to_shard))
         self.menu.add_cascade(label="Settings", menu=settings_menu)
         self.menu.add_command(label="Feedback", command=self.show_feedback_options)
         self.menu.add_command(label="Minimize", command=self.minimize)
@@ -156,6 +166,12 @@ class MixTeXApp:
         self.menu.tk_popup(event.x_root, event.y_root)
 
     def save_data(self, image, text, feedback):
+        if self.save_feedback_to_shard:
+            # Append-only: a later record for the same text supersedes earlier ones
+            with ShardWriter(self.feedback_shard_file, append=True) as writer:
+                writer.add(text, image, {'feedback': feedback, 'time': int(time.time())})
+            return
+
         file_name = f"{int(time.time())}.png"
         file_path = os.path.join(self.data_folder, file_name)
         image.save(file_path, 'PNG')
@@ -185,17 +201,22 @@ class MixTeXApp:
     def toggle_convert_align_to_equations(self):
         self.convert_align_to_equations_enabled = not self.convert_align_to_equations_enabled
 
+    def toggle_feedback_shard(self):
+        self.save_feedback_to_shard = not self.save_feedback_to_shard
+
     def minimize(self):
         self.root.withdraw()
         self.tray_icon.visible = True
 
     def show_about(self):
         about_text = "MixTeX\n版本: 3.2.4b \n作者: lrqlrqlrq \nQQ群：612725068 \nB站：bilibili.com/8922788 \nGithub:github.com/RQLuo"
+        self.log_queue.clear()
         self.text_box.delete(1.0, tk.END)
         self.text_box.insert(tk.END, about_text)
 
     def show_donate(self):
         donate_text = "\n!!!感谢您的支持!!!\n"
+        self.log_queue.clear()
         self.text_box.delete(1.0, tk.END)
         self.text_box.insert(tk.END, donate_text)
 
@@ -278,12 +299,14 @@ class MixTeXApp:
                     "Model Loading Error", 0)
                 return None
                     
-            tokenizer = RobertaTokenizer.from_pretrained(valid_path)
-            feature_extractor = ViTImageProcessor.from_pretrained(valid_path)
-            encoder_session = ort.InferenceSession(f"{valid_path}/encoder_model.onnx")
-            decoder_session = ort.InferenceSession(f"{valid_path}/decoder_model_merged.onnx")
+            # 优先使用本机已运行的 mixtex_daemon，否则在本进程内加载模型
+            client = InferenceClient(valid_path)
+            if client.daemon_available():
+                self.log(f"Using MixTeX daemon: {client.socket_path}")
+            else:
+                get_model(valid_path)
             self.log('\n===Model loaded successfully===\n')
-            return (tokenizer, feature_extractor, encoder_session, decoder_session)
+            return client
         except Exception as e:
             self.log(f"Model loading failed: {e}")
             import ctypes
@@ -369,58 +392,36 @@ class MixTeXApp:
 
     def mixtex_inference(self, max_length, num_layers, hidden_size, num_attention_heads, batch_size):
         if self.model is None:
-            return ""
-        tokenizer, feature_extractor, encoder_session, decoder_session = self.model  # type: ignore
+            return "", ""
         try:
             generated_text = ""
-            head_size = hidden_size // num_attention_heads
-            inputs = feature_extractor(self.current_image, return_tensors="np").pixel_values
-            encoder_outputs = encoder_session.run(None, {"pixel_values": inputs})[0]
-            
-         
-            num_layers = 6  # 修改为6层而不是3层
-            
-            decoder_inputs = {
-                "input_ids": tokenizer("<s>", return_tensors="np").input_ids.astype(np.int64),
-                "encoder_hidden_states": encoder_outputs,
-                "use_cache_branch": np.array([True], dtype=bool),
-                **{f"past_key_values.{i}.{t}": np.zeros((batch_size, num_attention_heads, 0, head_size), dtype=np.float32) 
-                for i in range(num_layers) for t in ["key", "value"]}
-            }
-            for _ in range(max_length):
-                decoder_outputs = decoder_session.run(None, decoder_inputs)
-                next_token_id = np.argmax(decoder_outputs[0][:, -1, :], axis=-1)  # type: ignore
-                generated_text += tokenizer.decode(next_token_id, skip_special_tokens=True)
-                self.log(tokenizer.decode(next_token_id, skip_special_tokens=True), end="")
-                if self.check_repetition(generated_text, 21):
-                    self.log('\n===?!Repetition detected!?===\n')
-                    self.save_data(self.current_image, generated_text, 'Repeat')
-                    break
-                if next_token_id == tokenizer.eos_token_id:
-                    self.log('\n===Successfully copied to clipboard===\n')
-                    break
-
-                decoder_inputs.update({
-                    "input_ids": next_token_id[:, None],
-                    **{f"past_key_values.{i}.{t}": decoder_outputs[i*2+1+j] 
-                    for i in range(num_layers) for j, t in enumerate(["key", "value"])}
-                })
-            if self.convert_align_to_equations_enabled:
-                generated_text = self.convert_align_to_equations(generated_text)
-            return generated_text
+            # Post-processed as it is decoded, so the log shows the final text;
+            # the text kept as self.output (for feedback) never uses $ for inline math
+            clipboard = LatexPostprocessor(self.use_dollars_for_inline_math, self.convert_align_to_equations_enabled)
+            output = LatexPostprocessor(False, self.convert_align_to_equations_enabled)
+            clipboard_parts, output_parts = [], []
+            info = {}
+            for token_text in self.model.stream(self.current_image, info=info, max_length=max_length):
+                generated_text += token_text
+                clipboard_parts.append(clipboard.feed(token_text))
+                output_parts.append(output.feed(token_text))
+                self.log(clipboard_parts[-1], end="")
+            clipboard_parts.append(clipboard.finish())
+            output_parts.append(output.finish())
+            self.log(clipboard_parts[-1], end="")
+            # stream_inference stops on EOS, on repetition or at max_length
+            stop_reason = info.get('stop_reason')
+            if stop_reason == 'repetition' or self.check_repetition(generated_text, 21):
+                self.log('\n===?!Repetition detected!?===\n')
+                self.save_data(self.current_image, generated_text, 'Repeat')
+            elif stop_reason == 'eos':
+                self.log('\n===Successfully copied to clipboard===\n')
+            else:
+                self.log(f'\n===?!Output truncated ({stop_reason}), copied anyway!?===\n')
+            return "".join(clipboard_parts), "".join(output_parts)
         except Exception as e:
             self.log(f"Error during OCR: {e}")
-            return ""
-
-    def convert_align_to_equations(self, text):
-        text = re.sub(r'\\begin\{align\*\}|\\end\{align\*\}', '', text).replace('&','')
-        equations = text.strip().split('\\\\')
-        converted = []
-        for eq in equations:
-            eq = eq.strip().replace('\\[','').replace('\\]','').replace('\n','')
-            if eq:
-                converted.append(f"$$ {eq} $$")
-        return '\n'.join(converted)
+            return "", ""
 
     def pad_image(self, img, out_size):
         x_img, y_img = out_size
@@ -447,11 +448,7 @@ class MixTeXApp:
                     image = ImageGrab.grabclipboard()
                     if image is not None and type(image) != list:
                         self.current_image = self.pad_image(image.convert("RGB"), (448,448))  # type: ignore
-                        result = self.mixtex_inference(512, 6, 768, 12, 1)  # Updated to 6 layers
-                        result = result.replace('\\[', '\\begin{align*}').replace('\\]', '\\end{align*}').replace('%', '\\%')
-                        self.output = result
-                        if self.use_dollars_for_inline_math:
-                            result = result.replace('\\(', '$').replace('\\)', '$')
+                        result, self.output = self.mixtex_inference(512, 6, 768, 12, 1)  # Updated to 6 layers
                         pyperclip.copy(result)
                 except Exception as e:
                     self.log(f"Error: {e}")
@@ -472,8 +469,23 @@ class MixTeXApp:
         self.tray_icon.icon = self.icon
 
     def log(self, message, end='\n'):
-        self.text_box.insert(tk.END, message + end)
-        self.text_box.see(tk.END)
+        # deque.append is atomic, so worker threads need no lock
+        self.log_queue.append(message + end)
+
+    def flush_log(self):
+        pieces = []
+        try:
+            while True:
+                pieces.append(self.log_queue.popleft())
+        except IndexError:
+            pass
+        if pieces:
+            self.text_box.insert(tk.END, ''.join(pieces))
+            lines = int(self.text_box.index('end-1c').split('.')[0])
+            if lines > self.LOG_MAX_LINES:
+                self.text_box.delete('1.0', f'{lines - self.LOG_MAX_LINES + 1}.0')
+            self.text_box.see(tk.END)
+        self.root.after(self.LOG_FRAME_MS, self.flush_log)
 
 if __name__ == '__main__':
     try:
@@ -27,7 +27,7 @@ with open(manifest_path, 'w') as f:
 # 修改 Analysis 配置部分
 a = Analysis(
     ['mixtex_ui.py'],
-    pathex=[],
+    pathex=['examples'],
     binaries=[],
     datas=[
         ('donate.png', '.'), 
@@ -78,6 +78,11 @@ a = Analysis(
         'PIL',
         'pystray',
         'numpy',
+
+        # === 共享模块 (examples/) ===
+        'mixtex_shard',
+        'mixtex_core',
+        'mixtex_trace',
     ],
     hookspath=[],
     hooksconfig={},